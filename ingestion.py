@@ -0,0 +1,92 @@
+"""
+    Python UK trading tax calculator
+
+    Copyright (C) 2015  Robert Carver
+
+    You may copy, modify and redistribute this file as allowed in the license agreement
+         but you must retain this header
+
+    See README.txt
+
+"""
+
+
+"""
+Read trades from lots of files at once
+
+Each file is described by a source tuple (fname, reader, kwargs)
+   fname is the file to read
+   reader is 'ib' for .html files from IB (see shredIBfiles.get_ib_trades), 'csv' for generic .csv files
+      (see shredgenericcsv.read_generic_csv), the name of any other importer registered in tradetable.py,
+      or a function which takes fname and kwargs and returns a TradeList
+   kwargs is a dict of arguments for the reader, eg dict(table_ref=8, colref="Account")
+
+Parsing files is slow, and they don't depend on each other, so we read them in parallel
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from shredIBfiles import get_ib_trades
+from shredgenericcsv import read_generic_csv
+from tradelist import merge_tradelists, remove_duplicate_trades
+from tradetable import IMPORTERS, read_trades
+
+READERS=dict(ib=get_ib_trades, csv=read_generic_csv)
+
+
+def _reader_function(reader):
+    if callable(reader):
+        return reader
+
+    if reader in READERS:
+        return READERS[reader]
+
+    if reader in IMPORTERS:
+        return partial(read_trades, importer=reader)
+
+    all_readers=list(READERS.keys())+[importer for importer in IMPORTERS.keys() if importer not in READERS]
+    raise Exception("Reader %s unknown. Use one of %s or a function" % (str(reader), ", ".join(all_readers)))
+
+def _read_source(source):
+    """
+    Returns the TradeList for a single source tuple
+    """
+    (fname, reader, kwargs)=source
+    read_function=_reader_function(reader)
+
+    return read_function(fname, **kwargs)
+
+def get_trades_from_sources(sources, processes=None, remove_duplicates=True):
+    """
+    Returns a single TradeList with the trades from all of sources, a list of (fname, reader, kwargs)
+
+    processes is the number of processes to read files with. If None we use one per cpu (but no more than the
+      number of files). If 1 everything is read in this process.
+
+    Trades which are in more than one file (because statements overlap) are only included once, unless
+      remove_duplicates is False, when they are just reported. See tradelist.remove_duplicate_trades
+
+    The trades are merged into date order. Trades with the same date are in the order of sources, so the
+    result is the same however many processes we use. If you use more than one process and a custom reader
+    function, it has to be defined at the top level of a module; and a custom importer has to be registered
+    when that module is imported.
+    """
+
+    ## Check the readers before we start anything
+    [_reader_function(reader) for (fname, reader, kwargs) in sources]
+
+    if processes is None:
+        processes=min(len(sources), os.cpu_count() or 1)
+
+    if processes<=1 or len(sources)<2:
+        results=[_read_source(source) for source in sources]
+    else:
+        ## map returns results in the order of sources, not the order they finish
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            results=list(executor.map(_read_source, sources))
+
+    results=remove_duplicate_trades(results, drop=remove_duplicates)
+
+    return merge_tradelists(results)
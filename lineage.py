@@ -0,0 +1,173 @@
+"""
+    Python UK trading tax calculator
+
+    Copyright (C) 2015  Robert Carver
+
+    You may copy, modify and redistribute this file as allowed in the license agreement
+         but you must retain this header
+
+    See README.txt
+
+"""
+
+
+"""
+Where each trade came from, kept as integers
+
+When we split trades we give the pieces IDs based on the original trade's ID: 123:1 and 123:2 for the two
+halves of an OverClose trade, and 123a, 123b ... for children allocated in matching. Rather than building these
+strings every time, each trade keeps a lineage id: a row in the LINEAGE table, which has the parent, the kind of
+split, and the split number, all in integer arrays. The string is only made when we print the trade.
+
+Lineage ids are only meaningful in the process that made them; pickled trades carry the string instead.
+
+LOTS is a store of trades as they were before we started allocating them to children. Children refer to the trade
+they were allocated from (their parent), and trades to their original size (original), by integer handles into it,
+rather than each keeping its own copy.
+"""
+
+from array import array
+
+from symbols import SYMBOLS
+from utils import letter_code
+
+## Kinds of lineage entry
+## An original trade. Number is the trade number, eg 123
+ROOT=0
+## An original trade with an ID that isn't a number. Number is the SYMBOLS id of the ID
+NAMED_ROOT=1
+## One half of an OverClose trade. Number is 1 for the closing half, 2 for the opening half
+PSEUDO=2
+## A child allocated from a parent trade. Number is the child number; 0 is a, 1 is b ... (see utils.letter_code)
+CHILD=3
+
+
+class LineageTable(object):
+    """
+    A table of lineage entries. Each entry is an integer id, and has a parent (-1 for originals), an original
+    (the root it came from, which is itself for originals), a kind and a number
+    """
+
+    def __init__(self):
+        setattr(self, 'parents', array('q'))
+        setattr(self, 'originals', array('q'))
+        setattr(self, 'kinds', array('b'))
+        setattr(self, 'numbers', array('q'))
+
+        ## Original trades only get one entry each
+        setattr(self, 'root_ids', dict())
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def _add(self, parent, kind, number):
+        lineageid=len(self.kinds)
+
+        self.parents.append(parent)
+        self.originals.append(lineageid if parent<0 else self.originals[parent])
+        self.kinds.append(kind)
+        self.numbers.append(number)
+
+        return lineageid
+
+    def root(self, tradeid):
+        """
+        Returns the lineage id for an original trade with string ID tradeid
+        """
+        if tradeid.isdigit() and str(int(tradeid))==tradeid:
+            key=(ROOT, int(tradeid))
+        else:
+            key=(NAMED_ROOT, SYMBOLS.intern(tradeid))
+
+        lineageid=self.root_ids.get(key, None)
+        if lineageid is None:
+            lineageid=self._add(-1, key[0], key[1])
+            self.root_ids[key]=lineageid
+
+        return lineageid
+
+    def pseudo(self, lineageid, number):
+        """
+        Returns a new lineage id for half number (1 or 2) of an OverClose trade with lineageid
+        """
+        return self._add(lineageid, PSEUDO, number)
+
+    def child(self, lineageid, number):
+        """
+        Returns a new lineage id for child number of a trade with lineageid
+        """
+        return self._add(lineageid, CHILD, number)
+
+    def parent(self, lineageid):
+        """
+        Returns the lineage id this one was split from, or -1 for an original
+        """
+        return self.parents[lineageid]
+
+    def original(self, lineageid):
+        """
+        Returns the lineage id of the original trade this one came from
+        """
+        return self.originals[lineageid]
+
+    def tradeid(self, lineageid):
+        """
+        Returns the string ID for lineageid, eg 123:1a
+        """
+        suffixes=[]
+        while True:
+            kind=self.kinds[lineageid]
+            number=self.numbers[lineageid]
+
+            if kind==ROOT:
+                suffixes.append(str(number))
+                break
+            elif kind==NAMED_ROOT:
+                suffixes.append(SYMBOLS.name(number))
+                break
+            elif kind==PSEUDO:
+                suffixes.append(":%d" % number)
+            else:
+                suffixes.append(letter_code(number))
+
+            lineageid=self.parents[lineageid]
+
+        return "".join(reversed(suffixes))
+
+
+LINEAGE=LineageTable()
+
+
+class LotRegistry(object):
+    """
+    A store of original trades, which mustn't be changed once they are added. Each has an integer handle
+    """
+
+    def __init__(self):
+        setattr(self, 'trades', [])
+        setattr(self, 'quantities', array('d'))
+
+    def __len__(self):
+        return len(self.trades)
+
+    def add(self, trade):
+        """
+        Adds trade, returns its handle
+        """
+        handle=len(self.trades)
+        self.trades.append(trade)
+        self.quantities.append(trade.SignQuantity)
+
+        return handle
+
+    def trade(self, handle):
+        return self.trades[handle]
+
+    def quantity(self, handle):
+        """
+        SignQuantity of the trade with handle
+        """
+        return self.quantities[handle]
+
+
+LOTS=LotRegistry()
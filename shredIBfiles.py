@@ -30,20 +30,36 @@ TRADES_LOC and POSITIONS_LOC indicate where in the trade and activity report res
 ASSETS=['Stocks', 'Futures', 'Forex']
 CURRENCIES=['GBP', 'JPY' ,'EUR', 'KRW', 'AUD', 'CHF', 'USD', 'CNH', 'SGD']
 
+## Rows with these classes contain trades; other rows are detail or sub totals
+SUMMARY_ROW_CLASSES=['summaryRow', 'row-summary', 'row-summary no-details']
+
 TRADES_LOC=1
 POSITIONS_LOC=7
 
+## Used to find the table of trades, and what its columns are called, if we don't know the format
+## The trades table has all of TRADES_SIGNATURE, and one each of the other lists
+TRADES_SIGNATURE=['Symbol', 'Quantity', 'Notional Value']
+DATE_COLUMNS=['Trade Date', 'Trade Date/Time', 'Date/Time']
+PRICE_COLUMNS=['Price', 'T. Price']
+COMM_COLUMNS=['Comm', 'Comm/Fee']
+
 ## End of formatting globals
 
 ## Imports
 
-import datetime
+import io
+import mmap
+import os
+import re
+from html.parser import HTMLParser
 
+import numpy as np
 import pandas as pd
 from bs4 import BeautifulSoup
 
-from trades import Trade
-from tradelist import TradeList
+from tradecache import cached_trades
+from tradetable import tradelist_from_table, empty_trade_table, register_importer
+from utils import parse_number_column, parse_date_column
 
 
 def _row_class(row):
@@ -56,45 +72,198 @@ def _row_class(row):
             return dattrs['class']
     return ""
 
-def _parse_html_table(rows):
-    """ 
-    Get data from rows 
+def _clean_header_row(table_headers):
+    """
+    Returns the header list we use to name our data frame, from a list of header strings
+    """
+
+    ## We add a column for the row class
+    headerlist=table_headers+['Class']
+
+    ##The terms notional value and proceeds are used depending on the asset class;
+    ##consistently use notional value
+    headerlist=["Notional Value" if x=="Proceeds" else x for x in headerlist]
+    headerlist=["Notional Value" if x=="PROCEEDS" else x for x in headerlist]
+    headerlist = ["Notional Value" if x == "NOTIONAL VALUE" else x for x in headerlist]
+
+    return headerlist
+
+def _rows_to_table(rows):
+    """
+    rows is a list of tuples (header strings, data strings, row class), one per row
+
+    Returns (headerrow, results) as used by _html_table_to_pddataframe
     """
     results = []
     headerrow=None
-    for row in rows:
-        table_headers = row.findAll('th')
+    for (table_headers, table_data, rowclass) in rows:
         if table_headers:
             """
             We've got headers. Note the first set of headers we find will be used to name our data frame
             The rest ignored
             """
             if headerrow is None:
-
-                ## Its the first set of headers
-                ##We add a column for the row class
-            
-                headerlist=[str(headers.getText()) for headers in table_headers]+['Class']
-
-                ##The terms notional value and proceeds are used depending on the asset class; 
-                ##consistently use notional value
-                headerlist=["Notional Value" if x=="Proceeds" else x for x in headerlist]
-                headerlist=["Notional Value" if x=="PROCEEDS" else x for x in headerlist]
-                headerlist = ["Notional Value" if x == "NOTIONAL VALUE" else x for x in headerlist]
-
-                headerrow=headerlist
-            
-        table_data = row.findAll('td')
+                headerrow=_clean_header_row(table_headers)
 
         if table_data:
             """
-            Add some normal data, including the class of the row 
+            Add some normal data, including the class of the row
             """
-            rowclass=_row_class(row)
-            results.append([str(data.getText()) for data in table_data]+[rowclass])
-            
+            results.append(table_data+[rowclass])
+
     return (headerrow, results)
 
+def _parse_html_table(rows):
+    """ 
+    Get data from rows 
+    """
+    rows=[([str(headers.getText()) for headers in row.findAll('th')],
+           [str(data.getText()) for data in row.findAll('td')],
+           _row_class(row)) for row in rows]
+
+    return _rows_to_table(rows)
+
+
+## Tags which never have children, so we don't wait for them to be closed
+VOID_TAGS=['area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link', 'meta',
+           'param', 'source', 'track', 'wbr']
+
+## Tags whose text BeautifulSoup's getText leaves out
+NO_TEXT_TAGS=['script', 'style', 'template']
+
+## How much of the file we feed to the streaming parser at a time
+STREAM_CHUNK_SIZE=65536
+
+class _StreamTableParser(HTMLParser):
+    """
+    Event driven parser for IB .html files
+
+    Walks the tags in order, counting tables until it reaches table_ref, and collects the rows of that table
+    in the same form as _parse_html_table. No document tree is built. If table_ref is None we collect
+    every table in the file.
+
+    Tags are closed the same way as BeautifulSoup's html.parser builder does, so the output is identical
+    """
+
+    def __init__(self, table_ref=None):
+        HTMLParser.__init__(self)
+
+        self.table_ref=table_ref
+        self.table_count=0
+
+        ## Names of all the currently open tags
+        self.open_tags=[]
+
+        ## Position in open_tags of the table we want, or None if we're not in it
+        self.table_depth=None
+        self.finished=False
+
+        ## Each table we collect is a list of rows
+        ## Each row is a tuple (list of header cells, list of data cells, row class)
+        ##   cells are lists of text fragments
+        ## open_elements mirrors open_tags, with the table, row or cell we are collecting (or None)
+        self.tables=[]
+        self.open_elements=[]
+
+        ## The cells which are currently open, in the same order as open_tags
+        self.open_cells=[]
+
+    def _open_elements_for(self, tagname):
+        return [openelement for (opentag, openelement) in zip(self.open_tags, self.open_elements)
+                if opentag==tagname and openelement is not None]
+
+    def handle_starttag(self, tag, attrs):
+        if self.finished:
+            return
+
+        element=None
+
+        if tag=='table':
+            if self.table_ref is None or self.table_count==self.table_ref:
+                if self.table_ref is not None:
+                    self.table_depth=len(self.open_tags)
+                element=[]
+                self.tables.append(element)
+            self.table_count=self.table_count+1
+
+        if tag in VOID_TAGS:
+            return
+
+        if tag=='tr':
+            ## Rows belong to every table they are inside
+            open_tables=self._open_elements_for('table')
+            if len(open_tables)>0:
+                ## Same as _row_class: the class is a list of class names
+                dattrs=dict(attrs)
+                if 'class' in dattrs:
+                    rowclass=(dattrs['class'] or "").split()
+                else:
+                    rowclass=""
+                element=([], [], rowclass)
+                [rows.append(element) for rows in open_tables]
+
+        elif tag=='th' or tag=='td':
+            ## Cells belong to every row they are inside
+            open_rows=self._open_elements_for('tr')
+            if len(open_rows)>0:
+                element=[]
+                if tag=='th':
+                    [row[0].append(element) for row in open_rows]
+                else:
+                    [row[1].append(element) for row in open_rows]
+                self.open_cells.append(element)
+
+        self.open_tags.append(tag)
+        self.open_elements.append(element)
+
+    def handle_startendtag(self, tag, attrs):
+        ## eg <br/> - open and close at once
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if self.finished or tag not in self.open_tags:
+            ## Closing tags which aren't open are ignored
+            return
+
+        ## Close everything up to and including the most recent tag of this name
+        lastidx=len(self.open_tags) - 1 - self.open_tags[::-1].index(tag)
+        closed_cells=len([closedtag for (closedtag, closedelement)
+                          in zip(self.open_tags[lastidx:], self.open_elements[lastidx:])
+                          if (closedtag=='th' or closedtag=='td') and closedelement is not None])
+        if closed_cells>0:
+            del self.open_cells[-closed_cells:]
+
+        del self.open_tags[lastidx:]
+        del self.open_elements[lastidx:]
+
+        if self.table_depth is not None and len(self.open_tags)<=self.table_depth:
+            ## We've closed our table
+            self.finished=True
+
+    def handle_data(self, data):
+        if self.finished:
+            return
+
+        ## Same as getText, which doesn't include scripts and so on
+        if any([tag in self.open_tags for tag in NO_TEXT_TAGS]):
+            return
+
+        ## Text belongs to every cell it is inside
+        [cell.append(data) for cell in self.open_cells]
+
+    def table(self, tableidx=0):
+        """
+        Returns (headerrow, results) as _parse_html_table does, for the tableidx'th table we collected
+        """
+        rows=[(["".join(cell) for cell in headers], ["".join(cell) for cell in data], rowclass)
+              for (headers, data, rowclass) in self.tables[tableidx]]
+
+        return _rows_to_table(rows)
+
+    def all_tables(self):
+        return [self.table(tableidx) for tableidx in range(len(self.tables))]
 
 
 def _html_row(row, clength):
@@ -130,66 +299,43 @@ def _html_table_to_pddataframe(headerrow, table_data):
     
     return main_table
 
-def _check_ignore_row(row, colref="Acct ID"):
+def _real_data_rows(main_table, colref="Acct ID"):
     """
-    Returns TRUE if rows don't contain real data or positions
+    Returns a boolean array, True for rows which contain real data or positions
+
+    Sub total rows have 'Total' in colref. Otherwise we only want summary rows; the rest is granular detail.
+    The class can be a plain string, or a list of class names which has been turned into a string
+    eg "['row-summary', 'no-details']", so we reduce them all to class names seperated by spaces first
     """
-    if "Total" in row[colref]:
-        """
-        It's a sub total row
-        """
-        return True
 
-    row_class = row['Class']
+    row_classes=main_table['Class'].str.replace(r"[\[\]',]", " ", regex=True).str.split().str.join(" ")
 
-    if not (row_class=='summaryRow' or row_class=="row-summary"
-            or row_class=="row-summary no-details"
-    or row_class=="['row-summary']"
-            or row_class =="['summaryRow']"
-    or row_class == "['row-summary', 'no-details']"):
-        """
-        It's Granualar detail, can ignore
-        """
-        return True 
-    
-    return False
+    subtotal_rows=main_table[colref].str.contains("Total", regex=False)
+
+    return (row_classes.isin(SUMMARY_ROW_CLASSES) & ~subtotal_rows).values
 
-def _select_and_clean_pd_dataframe(main_table, selection_idx, colref="Acct ID"):
+def _select_and_clean_pd_dataframe(main_table, selection_idx, colref="Acct ID", real_rows=None):
     """
     Remove 'dirty' rows from a dataframe, i.e. not real data
+
+    real_rows is the result of _real_data_rows for all of main_table, if we've already worked it out
     """
     
     if len(selection_idx)==0:
         return None
-    
-    pd_df=main_table.iloc[selection_idx,:]
-
-    dirty_rows=[rowidx for rowidx in range(len(pd_df.index))
-                if _check_ignore_row(pd_df.iloc[rowidx], colref)]
-    pd_df=pd_df.drop(pd_df.index[dirty_rows])
-
-    if len(pd_df.index)==0:
-        return None
 
-    return pd_df
+    if real_rows is None:
+        real_rows=_real_data_rows(main_table, colref)
 
+    selection_idx=np.asarray(selection_idx)
+    selection_idx=selection_idx[real_rows[selection_idx]]
 
-def _check_index_row(row, colref="Acct ID"):
-    """
-    Index rows are empty except for the contents of colref. Returns bool
-    """
-    restorfow=row.drop(colref)
-    ans=list(restorfow.values)
-    otherrowsempty=all([len(x)==0 for x in ans])
-    
-    return otherrowsempty
-
-def _check_blank_row(row):
-    return all([len(x)==0 for x in row])
+    if len(selection_idx)==0:
+        return None
 
+    pd_df=main_table.iloc[selection_idx,:]
 
-def _get_index_row(row, colref):
-    return row[colref]
+    return pd_df
 
 
 def _get_all_longnames_assets(table, colref="Acct ID"):
@@ -233,55 +379,48 @@ def _parse_pandas_df(main_table, colref="Acct ID"):
     ## Create an empty recursive structure
     ## Each entry contains a list of row indices
     results=dict([(hname, dict([(ccy, []) for ccy in currencies])) for hname in assetshortnames])
-    
-    ## Loop through populating the recursive structure, adding row names to it
-    rowidx=0
-    current_header=None
-    current_currency=None
 
-    total_len=len(main_table.index)
+    ## Work out what each row is, all in one go
+    ## Blank rows are empty everywhere. Index rows are empty except for colref, and contain eithier an
+    ##   asset class or a currency. Everything else is data
+    emptycells=main_table.eq('')
+    blank_rows=emptycells.all(axis=1).values
+    index_rows=emptycells.drop(columns=colref).all(axis=1).values & ~blank_rows
+    data_rows=~(blank_rows | index_rows)
 
+    indexentries=main_table[colref]
+    asset_rows=index_rows & indexentries.isin(assetlongnames).values
+    currency_rows=index_rows & ~asset_rows & indexentries.isin(currencies).values
 
-    while rowidx<total_len:
-        row=main_table.iloc[rowidx]
+    if (index_rows & ~asset_rows & ~currency_rows).any():
+        raise Exception("Unrecognised header")
 
-        if _check_blank_row(row):
-            rowidx=rowidx+1
-            continue
+    ## Each data row gets the asset class and currency of the last index rows above it
+    ## Asset classes are at a higher level than FX, so the currency is reset by each new asset class
+    longnames_to_shortnames=dict()
+    for (shortname, longname) in assetspacked:
+        longnames_to_shortnames.setdefault(longname, shortname)
 
-        if _check_index_row(row, colref):
-            ## It's an index row, i.e. it contains eithier an asset class or a currency
-            ## Return the name of the index (asset class or currency
-            indexentry=_get_index_row(row, colref)
+    asset_labels=indexentries.map(longnames_to_shortnames).where(asset_rows).ffill()
+    asset_sections=np.cumsum(asset_rows)
+    currency_labels=indexentries.where(currency_rows).groupby(asset_sections).ffill()
 
-            if indexentry in assetlongnames:
-                ## It's an asset class. Since these are at a higher level than FX we reset the currency
-                current_header=[shortname for shortname, longname in assetspacked
-                                if longname==indexentry][0]
-                current_currency=None
+    if (data_rows & (asset_labels.isna().values | currency_labels.isna().values)).any():
+        ## This will happen if we have extraenous rows before the headers
+        raise Exception("Found data before eithier asset class or currency was set")
 
-            elif indexentry in currencies:
-                ## It's a currency.
-                current_currency=indexentry
-            else:
-                raise Exception("Unrecognised header")
-
-        else:
-            ## not an index, populating the table
-            if current_header is None or current_currency is None:
-                ## This will happen if we have extraenous rows before the headers
-                raise Exception("Found data before eithier asset class or currency was set")
-            else:
-                ## Add the row index to the right part of the dict
-                results[current_header][current_currency].append(rowidx)
-
-        ## next row
-        rowidx=rowidx+1
+    ## Add the data row indices to the right part of the dict
+    real_rows=_real_data_rows(main_table, colref)
+    data_positions=np.flatnonzero(data_rows)
+    data_labels=pd.DataFrame(dict(asset=asset_labels.values[data_positions],
+                                  ccy=currency_labels.values[data_positions]))
 
+    for ((assetname, ccy), group_positions) in data_labels.groupby(['asset', 'ccy'], sort=False).indices.items():
+        results[assetname][ccy]=list(data_positions[group_positions])
 
         ## Create a dict of dicts of dataframes, with the appropriate subindex, cleaned up
     df_results=dict([(assetname, dict([
-                                    (ccy, _select_and_clean_pd_dataframe(main_table, results[assetname][ccy], colref) )
+                                    (ccy, _select_and_clean_pd_dataframe(main_table, results[assetname][ccy], colref, real_rows))
                                     for ccy in currencies])) for assetname in assetshortnames])
     
     return df_results
@@ -319,24 +458,28 @@ def _collapse_recursive_dict(df_results):
 
 
 
-def _parse_trade_date(tradedate):
-    try:
-        return datetime.datetime.strptime(tradedate, "%Y-%m-%d, %H:%M:%S")
-    except:
-        return datetime.datetime.strptime(tradedate, "%Y-%m-%d")
+## Trade dates can have times in them, or not
+TRADE_DATE_FORMATS=["%Y-%m-%d, %H:%M:%S", "%Y-%m-%d"]
+
+def _date_column_label(all_results):
+    """
+    The date column has been called different things over time
+    """
+    col_labels=[str(x) for x in all_results.columns]
+    for date_label in DATE_COLUMNS:
+        if date_label in col_labels:
+            return date_label
+
+    raise Exception("Date column not found")
 
     
 
-def _read_ib_html(fname, table_ref):
+def _read_ib_html_soup(file_handle, table_ref, fname):
     """
-    Reads a single table from an .html file fname produced by IB reports, and returns a pandas dataframe
-    
-    table_ref gives position of table in .html stack
+    Returns (headerrow, table_data) for a single table, by building the whole document with BeautifulSoup
     """
 
-    ## Open the file
-    with open(fname,'r') as file_handle:
-        soup = BeautifulSoup(file_handle.read(), features="html.parser")
+    soup = BeautifulSoup(file_handle.read(), features="html.parser")
     if len(soup)==0:
         raise Exception("Empty or non existent html file %s" % fname)
     
@@ -346,7 +489,175 @@ def _read_ib_html(fname, table_ref):
     table_rows = table.findAll('tr')
     
     ## Process the rows from html into lists
-    (headerrow, table_data) = _parse_html_table(table_rows)
+    return _parse_html_table(table_rows)
+
+def _read_ib_html_stream(file_handle, table_ref, fname):
+    """
+    Returns (headerrow, table_data) for a single table, walking the file as a stream of tags
+
+    We stop reading as soon as the table has been closed
+    """
+
+    parser=_StreamTableParser(table_ref)
+    empty=True
+
+    while not parser.finished:
+        chunk=file_handle.read(STREAM_CHUNK_SIZE)
+        if len(chunk)==0:
+            break
+        empty=False
+        parser.feed(chunk)
+
+    if not parser.finished:
+        ## Flush anything left at the end of the file
+        parser.close()
+
+    if empty:
+        raise Exception("Empty or non existent html file %s" % fname)
+
+    if len(parser.tables)==0:
+        raise Exception("Only %d tables in html file %s, can't get table %d" % (parser.table_count, fname, table_ref))
+
+    return parser.table()
+
+## Finds table tags in the raw bytes of a file
+TABLE_TAG_RE=re.compile(rb'<(/?)table\b', re.IGNORECASE)
+
+## Finds any start or end tag in raw bytes: (slash if an end tag, name, slash if it closes itself)
+TAG_RE=re.compile(rb'<(/?)([a-zA-Z][^\s/>]*)[^>]*?(/?)>')
+
+## A cell with only text in it, which opens and closes cleanly
+TEXT_CELL_RE=re.compile(rb'<(td|th)\b[^>]*>[^<]*</\1>', re.IGNORECASE)
+
+VOID_TAG_BYTES=[tagname.encode('ascii') for tagname in VOID_TAGS]
+
+def _table_byte_range(fname, table_ref):
+    """
+    Returns (start, end) byte offsets of table number table_ref in the file, without parsing it
+
+    We memory map the file and look only for <table and </table> tags, keeping track of nesting.
+    Tables inside comments or scripts would be counted, but IB reports don't have those
+    """
+
+    if os.path.getsize(fname)==0:
+        raise Exception("Empty or non existent html file %s" % fname)
+
+    with open(fname, 'rb') as file_handle:
+        with mmap.mmap(file_handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            table_count=0
+            depth=0
+            start=None
+
+            for match in TABLE_TAG_RE.finditer(mapped):
+                if match.group(1)==b'/':
+                    depth=max(depth-1, 0)
+                    if start is not None and depth==0:
+                        end=mapped.find(b'>', match.end())
+                        if end==-1:
+                            end=len(mapped)
+                        else:
+                            end=end+1
+                        return (start, end)
+                    continue
+
+                if table_count==table_ref:
+                    start=match.start()
+                    depth=0
+                table_count=table_count+1
+                if start is not None:
+                    depth=depth+1
+
+            if start is None:
+                raise Exception("Only %d tables in html file %s, can't get table %d" % (table_count, fname, table_ref))
+
+            ## Table never closed, so runs to the end of the file
+            return (start, len(mapped))
+
+def _closes_only_own_tags(table_bytes):
+    """
+    Returns True if every end tag in table_bytes closes a tag opened in table_bytes
+
+    If not, when the whole file is parsed that end tag may close a tag from before the table, and the table
+      with it, so parsing table_bytes on their own could give more rows. Tags are closed as _StreamTableParser
+      does. Tags inside comments or scripts would be counted too, but IB reports don't have those
+    """
+
+    ## Most tags are in cells with only text, which can't close anything else, so we take those out first
+    table_bytes=TEXT_CELL_RE.sub(b'', table_bytes)
+
+    open_tags=[]
+
+    for (closing, tagname, selfclosing) in TAG_RE.findall(table_bytes):
+        tagname=tagname.lower()
+        if tagname in VOID_TAG_BYTES:
+            continue
+
+        if closing==b'':
+            if selfclosing==b'':
+                open_tags.append(tagname)
+
+        elif len(open_tags)>0 and open_tags[-1]==tagname:
+            open_tags.pop()
+
+        elif tagname in open_tags:
+            del open_tags[len(open_tags) - 1 - open_tags[::-1].index(tagname):]
+
+        else:
+            return False
+
+    return True
+
+def _read_table_slice(fname, table_ref):
+    """
+    Returns a file like object, containing only the html for table table_ref in fname
+
+    Returns None if the table's tags are badly nested, so we'd need to parse the whole file to get the
+      same table (see _closes_only_own_tags)
+    """
+
+    (start, end)=_table_byte_range(fname, table_ref)
+
+    with open(fname, 'rb') as file_handle:
+        with mmap.mmap(file_handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            table_bytes=mapped[start:end]
+
+    if not _closes_only_own_tags(table_bytes):
+        return None
+
+    ## Decode in the same way as opening the file in text mode would
+    return io.TextIOWrapper(io.BytesIO(table_bytes))
+
+def _read_ib_html(fname, table_ref, parser="soup", prefilter=False):
+    """
+    Reads a single table from an .html file fname produced by IB reports, and returns a pandas dataframe
+    
+    table_ref gives position of table in .html stack
+
+    parser can be: 'soup' builds the whole document with BeautifulSoup, 'stream' walks the tags without
+      building a document (faster, and uses much less memory on big files). Both give the same answer.
+
+    If prefilter is True we find the table by looking for table tags in the raw file, and only the table
+      itself is given to the parser. If the table closes a tag it didn't open (eg a </div> in the middle,
+      which ends the table early in a full parse) we parse the whole file instead. Tables inside comments
+      or scripts before ours are still counted by prefilter, so then it can give a different table.
+    """
+
+    if parser=="soup":
+        read_function=_read_ib_html_soup
+    elif parser=="stream":
+        read_function=_read_ib_html_stream
+    else:
+        raise Exception("Parser %s unknown. Use soup or stream" % parser)
+
+    table_slice=_read_table_slice(fname, table_ref) if prefilter else None
+
+    if table_slice is not None:
+        ## Only one table left, so it's the first one
+        with table_slice as file_handle:
+            (headerrow, table_data) = read_function(file_handle, 0, fname)
+    else:
+        with open(fname,'r') as file_handle:
+            (headerrow, table_data) = read_function(file_handle, table_ref, fname)
 
     ## Convert to pandas dataframe
     main_table=_html_table_to_pddataframe(headerrow, table_data)
@@ -356,60 +667,219 @@ def _read_ib_html(fname, table_ref):
 
 
 
-def _from_trades_row_to_trade(row, pricerow='Price', commrow="Comm"):
+class IBStatement(object):
     """
-    Convert a row of trades into a trade object
+    An .html file produced by IB reports, parsed once
+
+    Any table in it can then be returned as a pandas dataframe, by position or by looking for a set of
+    column names. Pass one of these to get_ib_trades instead of a file name to avoid parsing the file again.
+
+    parser is 'soup' or 'stream' as for _read_ib_html
     """
-    
+
+    def __init__(self, fname, parser="soup"):
+
+        with open(fname,'r') as file_handle:
+            if parser=="soup":
+                tables=_read_all_tables_soup(file_handle, fname)
+            elif parser=="stream":
+                tables=_read_all_tables_stream(file_handle, fname)
+            else:
+                raise Exception("Parser %s unknown. Use soup or stream" % parser)
+
+        setattr(self, "fname", fname)
+
+        ## list of tuples (headerrow, table_data)
+        setattr(self, "tables", tables)
+
+    def __repr__(self):
+        return "IB statement %s with %d tables" % (self.fname, len(self.tables))
+
+    def __len__(self):
+        return len(self.tables)
+
+    def headers(self, table_ref):
+        """
+        Returns the column names of a table, or None if it has no headers
+        """
+        return self.tables[table_ref][0]
+
+    def table(self, table_ref):
+        """
+        Returns table number table_ref as a pandas dataframe, the same as _read_ib_html does
+        """
+        if table_ref>=len(self.tables):
+            raise Exception("Only %d tables in html file %s, can't get table %d" %
+                            (len(self.tables), self.fname, table_ref))
+
+        (headerrow, table_data)=self.tables[table_ref]
+
+        return _html_table_to_pddataframe(headerrow, table_data)
+
+    def find_table(self, signature):
+        """
+        Returns the position of the first table whose column names include everything in signature
+        """
+        for table_ref in range(len(self.tables)):
+            headerrow=self.headers(table_ref)
+            if headerrow is None:
+                continue
+            if all([colname in headerrow for colname in signature]):
+                return table_ref
+
+        raise Exception("No table in html file %s has columns %s" % (self.fname, str(signature)))
+
+    def table_by_header(self, signature):
+        """
+        Returns the first table whose column names include everything in signature, as a pandas dataframe
+        """
+        return self.table(self.find_table(signature))
+
+def _first_column_found(headerrow, possible_columns):
+    found=[colname for colname in possible_columns if colname in headerrow]
+    if len(found)==0:
+        return None
+
+    return found[0]
+
+def detect_trades_table(statement):
+    """
+    Finds the table of trades in an IBStatement by looking at the column names of each table
+
+    Returns a dict with the arguments for get_ib_trades: table_ref, colref, pricerow, commrow, and daterow
+      colref is the first column, which holds the asset class and currency headings
+    """
+
+    for table_ref in range(len(statement)):
+        headerrow=statement.headers(table_ref)
+        if headerrow is None:
+            continue
+
+        if not all([colname in headerrow for colname in TRADES_SIGNATURE]):
+            continue
+
+        pricerow=_first_column_found(headerrow, PRICE_COLUMNS)
+        commrow=_first_column_found(headerrow, COMM_COLUMNS)
+        daterow=_first_column_found(headerrow, DATE_COLUMNS)
+
+        if pricerow is None or commrow is None or daterow is None:
+            continue
+
+        return dict(table_ref=table_ref, colref=headerrow[0], pricerow=pricerow, commrow=commrow, daterow=daterow)
+
+    raise Exception("Can't find a table of trades in html file %s" % statement.fname)
+
+def _read_all_tables_soup(file_handle, fname):
+    """
+    Returns a list of (headerrow, table_data), one for every table in the file
+    """
+
+    soup = BeautifulSoup(file_handle.read(), features="html.parser")
+    if len(soup)==0:
+        raise Exception("Empty or non existent html file %s" % fname)
+
+    return [_parse_html_table(table.findAll('tr')) for table in soup.findAll('table')]
+
+def _read_all_tables_stream(file_handle, fname):
+    """
+    Returns a list of (headerrow, table_data), one for every table in the file, in a single pass
+    """
+
+    parser=_StreamTableParser()
+    empty=True
+
+    while True:
+        chunk=file_handle.read(STREAM_CHUNK_SIZE)
+        if len(chunk)==0:
+            break
+        empty=False
+        parser.feed(chunk)
+    parser.close()
+
+    if empty:
+        raise Exception("Empty or non existent html file %s" % fname)
+
+    return parser.all_tables()
+
+
+
+
+def _from_pddf_to_trade_table(all_results, pricerow='Price', commrow="Comm", daterow=None):
+    """
+    Converts a pandas data frame to a trade table (see tradetable.py)
+
+    We clean up each column in one go
+
+    If daterow is None we look for the date column
+    """
+
+    if len(all_results.index)==0:
+        return empty_trade_table()
+
     ## IB has negative for buys, and positive for sales (i.e. cashflow method)
-    value=float(row['Notional Value'].replace(',',''))
+    ## Quantities are already signed
+    ## Note that taxes and commissions are reported as negative (cashflow)
 
-    quantity=float(row.Quantity.replace(',',''))
-    
-    ## Note that taxes and commissions are reported as negative (cashflow) 
-    ## Value is negative for buys and positive for sells, which is fine
-    ## quantities are already signed
-    
-    try:
-        Tax=abs(float(row.Tax.replace(',','')))
-    except:
-        Tax=0.0
-
-    col_labels=row.keys()
-    col_labels=[str(x) for x in col_labels]
-    if "Trade Date" in col_labels:
-        date_label="Trade Date"
-    elif "Trade Date/Time" in col_labels:
-        date_label="Trade Date/Time"
-    elif "Date/Time" in col_labels:
-        date_label="Date/Time"
+    ## Tax isn't always there, and can be blank
+    if "Tax" in all_results.columns:
+        taxes=np.abs(parse_number_column(all_results.Tax, default=0.0))
     else:
-        raise Exception("Date column not found")
+        taxes=np.zeros(len(all_results.index))
 
-    price_value = float(row[pricerow].replace(',', ''))
-    comm_value = abs(float(row[commrow].replace(',', '')))
+    if daterow is None:
+        daterow=_date_column_label(all_results)
 
-    this_trade=Trade(Code=row.Symbol, Currency=row.Currency, Price=price_value,
-                     Tax=Tax, 
-                     Commission=comm_value,
-                     Date=_parse_trade_date(row[date_label]), SignQuantity=quantity,
-                     Quantity=abs(quantity), Value=value, AssetClass=row.AssetClass)
-    
-    return this_trade
+    trade_table=pd.DataFrame(dict(Code=all_results.Symbol.values,
+                                  Date=parse_date_column(all_results[daterow], TRADE_DATE_FORMATS),
+                                  SignQuantity=parse_number_column(all_results.Quantity),
+                                  Price=parse_number_column(all_results[pricerow]),
+                                  Value=parse_number_column(all_results['Notional Value']),
+                                  Commission=np.abs(parse_number_column(all_results[commrow])),
+                                  Tax=taxes,
+                                  Currency=all_results.Currency.values,
+                                  AssetClass=all_results.AssetClass.values))
 
-def _from_pddf_to_trades_object(all_results, pricerow='Price', commrow="Comm"):
+    return trade_table
+
+
+
+def get_ib_trade_table(fname, table_ref = TRADES_LOC, colref="Acct ID", pricerow='Price', commrow="Comm",
+                       parser="soup", prefilter=False, autodetect=False):
     """
-    Converts a pandas data frame to a list of trades
+    Reads an .html file output by interactive brokers, returns a trade table (see tradetable.py)
+
+    See get_ib_trades for the arguments
     """
+
+    daterow=None
+
+    if autodetect and not isinstance(fname, IBStatement):
+        fname=IBStatement(fname, parser=parser)
+
+    if isinstance(fname, IBStatement):
+        print("Getting trades from %s" % fname.fname)
+        if autodetect:
+            table_args=detect_trades_table(fname)
+            print("Found trades in table %d" % table_args['table_ref'])
+            (table_ref, colref, pricerow, commrow, daterow)=[table_args[argname] for argname in
+                                                  ['table_ref', 'colref', 'pricerow', 'commrow', 'daterow']]
+        main_table=fname.table(table_ref)
+    else:
+        print("Getting trades from %s" % fname)
+        main_table=_read_ib_html(fname, table_ref=table_ref, parser=parser, prefilter=prefilter)
+
+    ## Convert to a recursive dict of dicts, whilst doing some cleaning
+    df_results=_parse_pandas_df(main_table,  colref=colref)
     
-    tlist=TradeList([_from_trades_row_to_trade(all_results.iloc[idx], pricerow=pricerow, commrow=commrow)
-                      for idx in range(len(all_results.index))])
+    ## Go back to a single data frame with extra columns added
+    all_results=_collapse_recursive_dict(df_results)
     
-    return tlist
-
+    ## Finally convert to a trade table
+    return _from_pddf_to_trade_table(all_results, pricerow=pricerow, commrow=commrow, daterow=daterow)
 
 
-def get_ib_trades(fname, table_ref = TRADES_LOC, colref="Acct ID", pricerow='Price', commrow="Comm"):
+def get_ib_trades(fname, table_ref = TRADES_LOC, colref="Acct ID", pricerow='Price', commrow="Comm",
+                  parser="soup", prefilter=False, cache_dir=None, autodetect=False):
     """
     Reads an .html file output by interactive brokers
     Returns a trade_list object
@@ -420,17 +890,36 @@ def get_ib_trades(fname, table_ref = TRADES_LOC, colref="Acct ID", pricerow='Pri
 
     You'll need the report for the current financial year, plus 
 
+    parser can be 'soup' or 'stream', and prefilter True or False; see _read_ib_html.
+      For big files use 'stream' and prefilter=True. Badly nested tags around the table make prefilter
+      fall back to parsing the whole file
+
+    fname can also be an IBStatement, which has already been parsed (parser and prefilter are then ignored)
+
+    If cache_dir is given, the trades are kept there and we only parse a file again if it has changed;
+      see tradecache.py
+
+    If autodetect is True we find the trades table and its columns ourselves, from the column names
+      (see detect_trades_table), and table_ref, colref, pricerow and commrow are ignored. The file is
+      only parsed once. prefilter is ignored.
+
     """
 
-    print("Getting trades from %s" % fname)
-    main_table=_read_ib_html(fname, table_ref=table_ref)
+    if cache_dir is not None and not isinstance(fname, IBStatement):
+        if autodetect:
+            key_args=dict(reader="ib", autodetect=True)
+        else:
+            key_args=dict(reader="ib", table_ref=table_ref, colref=colref, pricerow=pricerow, commrow=commrow)
+        read_function=lambda: get_ib_trades(fname, table_ref=table_ref, colref=colref, pricerow=pricerow,
+                                            commrow=commrow, parser=parser, prefilter=prefilter,
+                                            autodetect=autodetect)
+
+        return cached_trades(fname, key_args, read_function, cache_dir)
+
+    trade_table=get_ib_trade_table(fname, table_ref=table_ref, colref=colref, pricerow=pricerow, commrow=commrow,
+                                   parser=parser, prefilter=prefilter, autodetect=autodetect)
+
+    return tradelist_from_table(trade_table)
 
-    ## Convert to a recursive dict of dicts, whilst doing some cleaning
-    df_results=_parse_pandas_df(main_table,  colref=colref)
-    
-    ## Go back to a single data frame with extra columns added
-    all_results=_collapse_recursive_dict(df_results)
-    
-    ## Finally convert to a list of trades
-    return _from_pddf_to_trades_object(all_results, pricerow=pricerow, commrow=commrow)
 
+register_importer("ib", get_ib_trade_table)
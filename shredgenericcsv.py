@@ -18,54 +18,68 @@ Import a generic csv
 """
 
 import numpy as np
-import datetime
 import pandas as pd
-from trades import Trade
 from tradelist import TradeList
+from tradecache import cached_trades
+from tradetable import tradelist_from_table, register_importer
+from utils import parse_number_column, parse_date_column, parse_bs_column
 
-def _resolveBS(xstring):
-    if xstring=="B":
-        return "BUY"
-    elif xstring=="S":
-        return "SELL"
-
-def _resolvetype(xstring):
-    if type(xstring)==np.float64 or type(xstring)==np.int64 or type(xstring)==int:
-        xstring=float(xstring)
-        
-    if type(xstring)==float:
-        return xstring
-
-    if type(xstring)==str:
-        return float(xstring.replace(',',''))
-    
-    raise Exception("Type error")
+## Used by the chunked reader. Numbers can have commas in them, eg 1,000
+CSV_DTYPES={"B/S": str, "Date": str, "Company": str, "Shares": np.float64, "Price": np.float64,
+            "Charges": np.float64, "Tax": np.float64, "Currency": str}
+CSV_DATE_FORMAT="%d/%m/%Y"
 
-def from_csv_row_to_trade(row, useassetclass):
+def _from_genericpdf_to_trade_table(all_results, useassetclass):
     """
-    Taxes and commissions are positive 
-    
-    Quantity is unsigned
+    Converts a pandas data frame, or a chunk of one, to a trade table (see tradetable.py)
+
+    Everything is worked out a column at a time, including the values and signed quantities
     """
-    this_trade=Trade(Code=row.Company, Currency=row.Currency, Price=_resolvetype(row.Price), 
-                     Tax=_resolvetype(row.Tax), 
-                     Commission=_resolvetype(row.Charges), BS=_resolveBS(row["B/S"]), 
-                     Date=datetime.datetime.strptime(row['Date'], "%d/%m/%Y"), 
-                     Quantity=abs(_resolvetype(row.Shares)),
-                     AssetClass=useassetclass)
-    
-    return this_trade
 
-def _from_genericpdf_to_trades_object(all_results, useassetclass):
+    bs=parse_bs_column(all_results["B/S"])
+
+    quantities=np.abs(parse_number_column(all_results.Shares))
+    signquantities=np.where(np.array(bs)=="BUY", quantities, -quantities)
+
+    prices=np.array(parse_number_column(all_results.Price))
+
+    ## Cash flow method. Negative means buy ...
+    values=-prices*signquantities
+
+    trade_table=pd.DataFrame(dict(Code=all_results.Company.values,
+                                  Date=parse_date_column(all_results.Date, [CSV_DATE_FORMAT]),
+                                  SignQuantity=signquantities, Price=prices, Value=values,
+                                  Commission=parse_number_column(all_results.Charges, default=0.0),
+                                  Tax=parse_number_column(all_results.Tax, default=0.0),
+                                  Currency=all_results.Currency.values, AssetClass=useassetclass, BS=bs))
+
+    return trade_table
+
+def _read_generic_csv_in_chunks(fname, useassetclass, chunksize):
     """
-    Converts a pandas data frame to a list of trades
+    Reads a generic csv chunksize rows at a time, so we never have the whole file in a data frame
+    """
+
+    tradelist=TradeList()
+
+    for chunk in pd.read_csv(fname, usecols=list(CSV_DTYPES.keys()), dtype=CSV_DTYPES, thousands=',',
+                             chunksize=chunksize):
+        tradelist.extend(tradelist_from_table(_from_genericpdf_to_trade_table(chunk, useassetclass)))
+
+    return tradelist
+
+def get_generic_csv_trade_table(fname, useassetclass="Stocks"):
+    """
+    Import a generic csv, return a trade table (see tradetable.py). See read_generic_csv for the format
     """
-    tlist=TradeList([from_csv_row_to_trade(all_results.iloc[idx], useassetclass) for idx in range(len(all_results.index))])
-    
-    return tlist
 
+    ## 'Read it in
+    all_results=pd.read_csv(fname)
 
-def read_generic_csv(fname, useassetclass="Stocks"):
+    ## Convert, with values and signed quantities
+    return _from_genericpdf_to_trade_table(all_results, useassetclass)
+
+def read_generic_csv(fname, useassetclass="Stocks", cache_dir=None, chunksize=None):
     """
     Import a generic csv, return a TradeList
     
@@ -74,17 +88,26 @@ def read_generic_csv(fname, useassetclass="Stocks"):
     Date is in 14/02/2003 format
     Shares (quantity) is always positive
     Tax and Charges are always positive
+
+    If cache_dir is given, the trades are kept there and we only read the file again if it has changed;
+      see tradecache.py
+
+    If chunksize is given we read that many rows at a time, with fixed column types and date format.
+      Use this for very big files.
     
     """
 
-    ## 'Read it in
-    all_results=pd.read_csv(fname)
-    
-    ## Convert to a list of trades
-    tradelist=_from_genericpdf_to_trades_object(all_results, useassetclass)
-    
-    ## We need to add the values, and signed quantities, as these aren't included by default
-    tradelist=tradelist.add_values()
-    
-    return tradelist
+    if cache_dir is not None:
+        key_args=dict(reader="csv", useassetclass=useassetclass)
+        read_function=lambda: read_generic_csv(fname, useassetclass=useassetclass, chunksize=chunksize)
+
+        return cached_trades(fname, key_args, read_function, cache_dir)
+
+    if chunksize is not None:
+        return _read_generic_csv_in_chunks(fname, useassetclass, chunksize)
+
+    return tradelist_from_table(get_generic_csv_trade_table(fname, useassetclass=useassetclass))
+
+
+register_importer("csv", get_generic_csv_trade_table)
 
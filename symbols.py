@@ -0,0 +1,63 @@
+"""
+    Python UK trading tax calculator
+
+    Copyright (C) 2015  Robert Carver
+
+    You may copy, modify and redistribute this file as allowed in the license agreement
+         but you must retain this header
+
+    See README.txt
+
+"""
+
+
+"""
+A table of the strings we see over and over again in trades (codes, currencies and asset classes), so each
+trade can keep a small integer instead of its own string.
+
+There is one table, SYMBOLS, for the whole program. Integer ids are only meaningful in the process that made
+them, so anything sent to another process (eg pickled trades) has to use the strings.
+"""
+
+import numpy as np
+
+
+class SymbolTable(object):
+    """
+    Maps strings to integer ids, starting at 0, and back again
+    """
+
+    def __init__(self):
+        setattr(self, 'names', [])
+        setattr(self, 'ids', dict())
+
+    def __len__(self):
+        return len(self.names)
+
+    def intern(self, name):
+        """
+        Returns the id for name, adding it if we haven't seen it before
+        """
+        symbolid=self.ids.get(name, None)
+        if symbolid is None:
+            symbolid=len(self.names)
+            self.ids[name]=symbolid
+            self.names.append(name)
+
+        return symbolid
+
+    def name(self, symbolid):
+        """
+        Returns the string for symbolid
+        """
+        return self.names[symbolid]
+
+    def names_of(self, symbolids):
+        """
+        Returns a list of strings for an integer array of ids. -1 becomes None
+        """
+        names=np.array(self.names+[None], dtype=object)
+        return names[symbolids].tolist()
+
+
+SYMBOLS=SymbolTable()
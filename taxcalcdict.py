@@ -12,7 +12,7 @@
 
 import numpy as np
 import sys
-from tradelist import TradeList, TradeDictByCode
+from tradelist import TradeList, TradeDictByCode, SortedTradeList
 from utils import  which_tax_year, star_line,pretty
 
 from taxcalctradegroup import TaxCalcTradeGroup, zero_tax_tuple
@@ -146,7 +146,7 @@ class TaxCalcElement(object):
        attributes: matched, unmatched
            matched: list of TaxCalcTradeGroup objects (begins as empty)  
             
-            unmatched: TradeList of all unmatched trades. Initially this inherits all the trades in tradelist 
+            unmatched: SortedTradeList of all unmatched trades. Initially this inherits all the trades in tradelist 
     """
 
         
@@ -155,11 +155,13 @@ class TaxCalcElement(object):
         '''
         To set up the group we populate unmatched and have an empty matched
         '''
-        assert type(tradelist) is TradeList
+        assert isinstance(tradelist, TradeList)
         assert tradelist.check_same_code() is True
         
         setattr(self, "matched", dict())
-        setattr(self, "unmatched", tradelist)
+
+        ## Matching is done in date order, so we keep the trades that way
+        setattr(self, "unmatched", SortedTradeList(tradelist))
 
 
     def __repr__(self):
@@ -224,7 +226,7 @@ class TaxCalcElement(object):
                     self.unmatched.date_sort()
                     
                     tradetomatch=self.unmatched.pop()
-                    tradetomatch.modify(tradetype="Close")
+                    tradetomatch.modify_trusted(tradetype="Close")
                     
                     
                     taxcalcgroup=self.matchingforgroup(tradetomatch, CGTcalc)
@@ -33,7 +33,7 @@ class TaxCalcTradeGroup(object):
         We'd normally set up the group with a single closing trade
         '''
 
-        assert type(closingtrade) is Trade
+        assert isinstance(closingtrade, Trade)
         assert closingtrade.tradetype is "Close"
 
         setattr(self, "closingtrade", closingtrade)
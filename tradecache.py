@@ -0,0 +1,220 @@
+"""
+    Python UK trading tax calculator
+
+    Copyright (C) 2015  Robert Carver
+
+    You may copy, modify and redistribute this file as allowed in the license agreement
+         but you must retain this header
+
+    See README.txt
+
+"""
+
+
+"""
+An on disk cache of the trades we get from a file, so we don't need to parse the same file every time
+
+Entries are keyed by a hash of the contents of the file, plus the arguments used to read it. So if the file
+changes, or you read it differently, it will be read again.
+
+Each entry is a compressed numpy .npz file with one array per trade field. When the cache gets bigger than
+CACHE_MAX_BYTES the least recently used entries are deleted.
+"""
+
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+from trades import Trade
+from tradelist import TradeList
+
+## Change this whenever the way we read files changes, so old entries aren't used
+CACHE_VERSION=1
+
+## Maximum size of the cache directory
+CACHE_MAX_BYTES=200*1024*1024
+
+## Read files in blocks of this size when hashing them
+HASH_BLOCK_SIZE=1024*1024
+
+CACHE_SUFFIX=".npz"
+
+
+def _file_hash(fname):
+    """
+    Returns a hash of the contents of fname
+    """
+    hasher=hashlib.sha256()
+    with open(fname, 'rb') as file_handle:
+        while True:
+            block=file_handle.read(HASH_BLOCK_SIZE)
+            if len(block)==0:
+                break
+            hasher.update(block)
+
+    return hasher.hexdigest()
+
+def cache_key(fname, key_args):
+    """
+    Returns the cache key for file fname read with key_args, a dict of the arguments which change the result
+    """
+    hasher=hashlib.sha256()
+    hasher.update(("%d:%s:" % (CACHE_VERSION, _file_hash(fname))).encode())
+    hasher.update(repr(sorted(key_args.items())).encode())
+
+    return hasher.hexdigest()
+
+def _cache_fname(cache_dir, key):
+    return os.path.join(cache_dir, key+CACHE_SUFFIX)
+
+def _tradelist_to_arrays(tradelist):
+    """
+    Returns a dict of numpy arrays, one per trade field, or None if these trades can't be cached
+
+    Every trade must have the same fields, and they can only be strings, floats, bools or dates
+    """
+
+    if len(tradelist)==0:
+        return dict(_fields=np.array([], dtype=str))
+
+    fields=tradelist[0].argsused
+    if not all([trade.argsused==fields for trade in tradelist]):
+        return None
+
+    arg_types=tradelist[0]._type_check()
+    arrays=dict(_fields=np.array(fields, dtype=str))
+
+    for fieldname in fields:
+        values=[getattr(trade, fieldname) for trade in tradelist]
+        fieldtype=arg_types[fieldname]
+        if fieldtype is str:
+            arrays[fieldname]=np.array(values, dtype=str)
+        elif fieldtype is float:
+            arrays[fieldname]=np.array(values, dtype=np.float64)
+        elif fieldtype is bool:
+            arrays[fieldname]=np.array(values, dtype=bool)
+        elif fieldname=="Date":
+            arrays[fieldname]=np.array(values, dtype="datetime64[us]")
+        else:
+            ## eg links to other trades
+            return None
+
+    return arrays
+
+def _arrays_to_tradelist(arrays):
+    """
+    Inverse of _tradelist_to_arrays
+    """
+
+    fields=arrays['_fields'].tolist()
+
+    ## tolist gives us python types, including datetimes
+    columns=[arrays[fieldname].tolist() for fieldname in fields]
+
+    if len(columns)==0:
+        return TradeList()
+
+    ## These were good trades when we cached them
+    return TradeList([Trade.trusted(**dict(zip(fields, values))) for values in zip(*columns)])
+
+def _read_cache_entry(cache_fname):
+    """
+    Returns a TradeList, or None if we can't read the entry
+    """
+    if not os.path.exists(cache_fname):
+        return None
+
+    try:
+        with np.load(cache_fname) as arrays:
+            tradelist=_arrays_to_tradelist(arrays)
+    except Exception:
+        ## Corrupt or from an incompatible version; we'll write it again
+        return None
+
+    ## Mark it as recently used. Another process may have evicted it since we read it, which doesn't matter
+    try:
+        os.utime(cache_fname, None)
+    except FileNotFoundError:
+        pass
+
+    return tradelist
+
+def _write_cache_entry(cache_fname, tradelist):
+    """
+    Writes tradelist to cache_fname. Returns True if it could be cached
+    """
+    arrays=_tradelist_to_arrays(tradelist)
+    if arrays is None:
+        return False
+
+    ## Write to a temporary file first, so nobody sees a half written entry
+    cache_dir=os.path.dirname(cache_fname)
+    (file_descriptor, temp_fname)=tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    try:
+        with os.fdopen(file_descriptor, 'wb') as file_handle:
+            np.savez_compressed(file_handle, **arrays)
+        os.replace(temp_fname, cache_fname)
+    except Exception:
+        os.remove(temp_fname)
+        raise
+
+    return True
+
+def _entry_details(entry):
+    """
+    Returns (last used time, size, entry) for a cache entry, or None if it has gone
+    """
+    try:
+        return (os.path.getmtime(entry), os.path.getsize(entry), entry)
+    except FileNotFoundError:
+        return None
+
+def evict_cache(cache_dir, max_bytes=CACHE_MAX_BYTES):
+    """
+    Delete the least recently used entries in cache_dir until it is no bigger than max_bytes
+    """
+    entries=[os.path.join(cache_dir, entryname) for entryname in os.listdir(cache_dir)
+             if entryname.endswith(CACHE_SUFFIX)]
+    entries=[_entry_details(entry) for entry in entries]
+
+    ## Other processes using the same cache can delete entries at any time
+    entries=[entry for entry in entries if entry is not None]
+
+    ## Oldest first
+    entries.sort()
+    total_bytes=sum([entry[1] for entry in entries])
+
+    for (mtime, size, entry) in entries:
+        if total_bytes<=max_bytes:
+            break
+        try:
+            os.remove(entry)
+        except FileNotFoundError:
+            ## Someone else evicted it first
+            pass
+        total_bytes=total_bytes-size
+
+def cached_trades(fname, key_args, read_function, cache_dir, max_bytes=CACHE_MAX_BYTES):
+    """
+    Returns the TradeList from read_function(), which reads fname, or from the cache if we already have it
+
+    key_args is a dict of the arguments to read_function which change what it returns
+    """
+
+    os.makedirs(cache_dir, exist_ok=True)
+
+    cache_fname=_cache_fname(cache_dir, cache_key(fname, key_args))
+
+    tradelist=_read_cache_entry(cache_fname)
+    if tradelist is not None:
+        print("Getting trades from %s (cached)" % fname)
+        return tradelist
+
+    tradelist=read_function()
+
+    if _write_cache_entry(cache_fname, tradelist):
+        evict_cache(cache_dir, max_bytes)
+
+    return tradelist
@@ -0,0 +1,277 @@
+"""
+    Python UK trading tax calculator
+
+    Copyright (C) 2015  Robert Carver
+
+    You may copy, modify and redistribute this file as allowed in the license agreement
+         but you must retain this header
+
+    See README.txt
+
+"""
+
+
+"""
+A TradeFrame holds trades as columns: one numpy array per field, rather than a list of Trade objects
+
+Code, Currency and AssetClass are categorical: arrays of the integer ids from symbols.SYMBOLS, the same ids the
+trades themselves use.
+
+It does the things calculatetax needs doing to a whole TradeList (sorting, splitting by code, cumulative
+positions, trade types, selecting trades, pro rata scaling) at array speed, and uses a fraction of the memory.
+Convert with TradeFrame.from_tradelist and TradeList.from_tradeframe.
+
+Each row remembers where it came from (rowid), so results can be written back to the original trades; see
+trades_by_row. TradeDictByCode.add_cumulative_data works this way.
+"""
+
+from operator import attrgetter
+import numpy as np
+import pandas as pd
+
+from symbols import SYMBOLS
+from trades import SLOT_NAMES
+
+## Numeric fields, which every trade has
+FRAME_FLOAT_FIELDS=['SignQuantity', 'Price', 'Value', 'Commission', 'Tax']
+
+## Optional numeric fields; nan if a trade doesn't have them
+FRAME_OPTIONAL_FLOAT_FIELDS=['FXRate']
+
+## Fields held as categories. AssetClass is optional, and is -1 if a trade doesn't have it
+FRAME_CATEGORICAL_FIELDS=['Code', 'Currency', 'AssetClass']
+
+DATE_DTYPE="datetime64[us]"
+
+FRAME_FIELDS=FRAME_FLOAT_FIELDS+FRAME_OPTIONAL_FLOAT_FIELDS+FRAME_CATEGORICAL_FIELDS+['Date']
+
+## See TradeFrame.trade_types
+TRADE_TYPES=("Open", "Close", "OverClose")
+
+
+def group_rows(groups):
+    """
+    Returns a list of arrays of row numbers, one for each different value in the integer array groups
+
+    Groups are in order of their values, and rows stay in order within each group
+    """
+    order=np.argsort(groups, kind="stable")
+    boundaries=np.flatnonzero(np.diff(groups[order]))+1
+
+    return [rows for rows in np.split(order, boundaries) if len(rows)>0]
+
+def grouped_cumsum(values, groups):
+    """
+    Returns the cumulative sum of values within each group, in the order they're in
+
+    We don't use pandas for this, as it compensates for rounding; we want exactly the same answer as adding up
+    one at a time, like np.cumsum
+    """
+    results=np.empty(len(values), dtype=np.float64)
+    for rows in group_rows(groups):
+        results[rows]=np.cumsum(values[rows])
+
+    return results
+
+class TradeFrame(object):
+    """
+    Trades as columns
+
+    columns is a dict of numpy arrays, all the same length: one for each of FRAME_FLOAT_FIELDS,
+      FRAME_OPTIONAL_FLOAT_FIELDS, Date, rowid, and an array of symbol ids for each of FRAME_CATEGORICAL_FIELDS
+
+    A TradeFrame can have only some of these (see from_tradelist), but always has rowid
+    """
+
+    def __init__(self, columns):
+        setattr(self, 'columns', columns)
+
+    @classmethod
+    def from_tradelist(cls, tradelist, fields=None):
+        """
+        Returns a TradeFrame with the trades in tradelist, in the same order. They must have SignQuantity and Value
+
+        fields is a list of the fields we want, from FRAME_FIELDS; default is all of them
+        """
+        if fields is None:
+            fields=FRAME_FIELDS
+
+        columns=dict()
+
+        for fieldname in fields:
+            if fieldname in FRAME_FLOAT_FIELDS:
+                columns[fieldname]=np.array(list(map(attrgetter(fieldname), tradelist)), dtype=np.float64)
+
+            elif fieldname in FRAME_OPTIONAL_FLOAT_FIELDS:
+                columns[fieldname]=np.array([getattr(trade, fieldname, np.nan) for trade in tradelist],
+                                            dtype=np.float64)
+
+            elif fieldname in FRAME_CATEGORICAL_FIELDS:
+                slotname=SLOT_NAMES[fieldname]
+                columns[fieldname]=np.array([getattr(trade, slotname, -1) for trade in tradelist], dtype=np.int32)
+
+            elif fieldname=="Date":
+                ## pandas converts a list of datetimes much faster than numpy does
+                columns['Date']=pd.DatetimeIndex(list(map(attrgetter("Date"), tradelist))).values.astype(DATE_DTYPE)
+
+            else:
+                raise Exception("TradeFrame can't have field %s" % fieldname)
+
+        columns['rowid']=np.arange(len(tradelist))
+
+        return cls(columns)
+
+    def trades_by_row(self, trades):
+        """
+        Returns a list of the trades each of our rows came from, in our order, so results can be written back to
+          them. trades is the list we were made from (see from_tradelist), so we can find them by rowid
+        """
+        return [trades[rowid] for rowid in self.columns['rowid'].tolist()]
+
+    def __len__(self):
+        return len(self.columns['rowid'])
+
+    def __repr__(self):
+        return "TradeFrame with %d trades" % len(self)
+
+    def category_values(self, fieldname):
+        """
+        Returns a list of the names in categorical column fieldname, one per row
+        """
+        return SYMBOLS.names_of(self.columns[fieldname])
+
+    def select(self, idx):
+        """
+        Returns a TradeFrame with the rows in idx, an array of indices or booleans
+        """
+        columns=dict([(fieldname, column[idx]) for (fieldname, column) in self.columns.items()])
+        return TradeFrame(columns)
+
+    def date_sort(self):
+        """
+        Returns a TradeFrame in date order. Trades with the same date stay in the same order
+        """
+        return self.select(np.argsort(self.columns['Date'], kind="stable"))
+
+    def code_and_date_sort(self):
+        """
+        Returns a TradeFrame sorted by code (in order of symbol id), then date. Stable
+        """
+        return self.select(np.lexsort((self.columns['Date'], self.columns['Code'])))
+
+    def separatecode(self):
+        """
+        Returns a dict of TradeFrames, one per code, each in the same order as we are
+        """
+        codes=self.columns['Code']
+
+        return dict([(SYMBOLS.name(codes[rows[0]]), self.select(rows)) for rows in group_rows(codes)])
+
+    def check_same_code(self):
+        return len(np.unique(self.columns['Code']))<=1
+
+    def check_same_code_in_groups(self, lengths):
+        """
+        Returns True if the rows, taken as consecutive groups with lengths, have a single code in each group, and
+          a different code in each
+        """
+        codes=self.columns['Code']
+        groupcodes=codes[np.cumsum([0]+lengths[:-1])]
+
+        return (codes==np.repeat(groupcodes, lengths)).all() and len(np.unique(groupcodes))==len(lengths)
+
+    def check_same_currency(self):
+        return len(np.unique(self.columns['Currency']))<=1
+
+    def check_same_sign(self):
+        return len(np.unique(np.sign(self.columns['SignQuantity'])))<=1
+
+    def all_currencies(self):
+        """
+        Unique list of currencies used
+        """
+        return SYMBOLS.names_of(np.unique(self.columns['Currency']))
+
+    def cumulative_position(self):
+        """
+        Returns an array with the position in each code after each trade, in the order we're in
+
+        This is exactly the same as TradeList._cumulative_trades
+        """
+        return grouped_cumsum(self.columns['SignQuantity'], self.columns['Code'])
+
+    def trade_types(self):
+        """
+        Returns a list with the type of each trade, in the order we're in: Open, Close or OverClose
+
+        Trade type is determined by the change in position in that code from the previous trade to this one,
+          so the trades in each code must be in date order. The first trade in a code is always an Open
+        """
+        if len(self)==0:
+            return []
+
+        codes=self.columns['Code']
+        position=self.cumulative_position()
+
+        ## Previous position in the same code, for each row
+        order=np.argsort(codes, kind="stable")
+        lastposition=np.empty(len(self), dtype=np.float64)
+        lastposition[order[1:]]=position[order[:-1]]
+
+        first=np.ones(len(self), dtype=bool)
+        first[order[1:]]=codes[order[1:]]!=codes[order[:-1]]
+        lastposition[first]=0.0
+
+        sign_change=((position>0) & (lastposition<0)) | ((position<0) & (lastposition>0))
+        closing=np.abs(position)<np.abs(lastposition)
+
+        ## Indices into TRADE_TYPES
+        typeidx=np.where(sign_change, 2, np.where(closing, 1, 0))
+        typeidx[first]=0
+
+        return [TRADE_TYPES[idx] for idx in typeidx.tolist()]
+
+    def final_position(self):
+        if len(self)==0:
+            return 0.0
+
+        if not self.check_same_code():
+            raise Exception("You can't produce final position as not same code")
+
+        return float(np.cumsum(self.columns['SignQuantity'])[-1])
+
+    def final_positions_as_dict(self):
+        return dict([(code, tradeframe.final_position()) for (code, tradeframe) in self.separatecode().items()])
+
+    def average_value(self):
+        ## Return average value (absolute)
+        quantity=self.final_position()
+
+        ## can be zero
+        if quantity==0.0:
+            return np.nan
+
+        values=float(np.cumsum(self.columns['Value'])[-1])
+
+        return abs(values/quantity)
+
+    def range_of_dates(self):
+        ## Return a tuple, with the range of dates
+
+        if len(self)==0:
+            return (None, None)
+
+        dates=self.columns['Date']
+        return (dates.min().item(), dates.max().item())
+
+    def pro_rata(self, pro_rata):
+        """
+        Returns a TradeFrame with quantities, values, commissions and taxes scaled by pro_rata
+
+        pro_rata is a single number, or an array with one per trade. As Trade._share_of_trade
+        """
+        columns=dict(self.columns)
+        for fieldname in ['SignQuantity', 'Value', 'Commission', 'Tax']:
+            columns[fieldname]=self.columns[fieldname]*pro_rata
+
+        return TradeFrame(columns)
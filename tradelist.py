@@ -11,30 +11,123 @@
 """
 
 
+import bisect
 import datetime
+import heapq
+import itertools
 from copy import copy
+from operator import attrgetter
 import numpy as np
+import pandas as pd
 
-from utils import  list_of_dict_class_to_pandas_df, uniquets, \
+from symbols import SYMBOLS
+from trades import Trade, SYMBOL_FIELDS, SLOT_NAMES, FIELD_BITS, FIELD_TYPES, init_allocations
+from tradeframe import TradeFrame, FRAME_FLOAT_FIELDS, FRAME_OPTIONAL_FLOAT_FIELDS
+from utils import  uniquets, \
                    check_identical_attribute, signs_match, signs_match_list, any_duplicates
 
 THRESHOLD=0.0001    
 
+## Fields in TradeList.as_dataframe, unless we ask for others: the numbers, dates and symbols we usually want.
+## TradeID and the other fields are slow to make for lots of trades
+DATAFRAME_FIELDS=['Code', 'Date', 'Currency', 'SignQuantity', 'Price', 'Value', 'Commission', 'Tax']
+
 class TradeList(list):
     '''
     A trade_list object is a list of trades
     
-    
+    We remember if the list is known to be in date order, so we don't have to keep sorting it. Anything which
+    adds or replaces trades forgets this; removing trades doesn't change the order.
     '''
 
+    _date_sorted=False
+
+    def append(self, trade):
+        self._date_sorted=False
+        list.append(self, trade)
+
+    def extend(self, trades):
+        self._date_sorted=False
+        list.extend(self, trades)
+
+    def insert(self, idx, trade):
+        self._date_sorted=False
+        list.insert(self, idx, trade)
+
+    def __setitem__(self, idx, trade):
+        self._date_sorted=False
+        list.__setitem__(self, idx, trade)
+
+    def __iadd__(self, trades):
+        self._date_sorted=False
+        return list.__iadd__(self, trades)
+
+    def reverse(self):
+        self._date_sorted=False
+        list.reverse(self)
+
+    def sort(self, *args, **kwargs):
+        self._date_sorted=False
+        list.sort(self, *args, **kwargs)
+
+    def is_date_sorted(self):
+        """
+        Returns True if the trades are in date order. Checks, if we don't already know
+        """
+        if not self._date_sorted:
+            self._date_sorted=all(self[idx-1].Date<=self[idx].Date for idx in range(1, len(self)))
+
+        return self._date_sorted
+
+    @classmethod
+    def from_tradeframe(cls, tradeframe):
+        """
+        Returns a TradeList with new Trade objects for each row of tradeframe, which must have all the fields
+        """
+        if len(tradeframe)==0:
+            return cls()
+
+        fields=FRAME_FLOAT_FIELDS+['Code', 'Currency', 'Date', 'Quantity']
+        columns=[tradeframe.columns[fieldname].tolist() for fieldname in FRAME_FLOAT_FIELDS]
+        columns=columns+[tradeframe.category_values('Code'), tradeframe.category_values('Currency'),
+                         tradeframe.columns['Date'].tolist(), np.abs(tradeframe.columns['SignQuantity']).tolist()]
+
+        tradelist=cls([Trade.trusted(**dict(zip(fields, values))) for values in zip(*columns)])
+
+        ## Only add optional fields where they were there to start with
+        for fieldname in FRAME_OPTIONAL_FLOAT_FIELDS:
+            for (trade, value) in zip(tradelist, tradeframe.columns[fieldname].tolist()):
+                if not np.isnan(value):
+                    trade.modify_trusted(**{fieldname: value})
+
+        for (trade, value) in zip(tradelist, tradeframe.category_values('AssetClass')):
+            if value is not None:
+                trade.modify_trusted(AssetClass=value)
+
+        return tradelist
+
+    def _remove_trades(self, trades):
+        """
+        Removes trades, each of which must be in the list once, in one pass. The rest stay in the same order
+        """
+        ## Trades are only equal if they are the same object
+        to_remove=set([id(trade) for trade in trades])
+        remaining=[trade for trade in self if id(trade) not in to_remove]
+        assert len(remaining)+len(trades)==len(self)
+
+        list.__setitem__(self, slice(None), remaining)
+
+    def _same_order(self, tradelist):
+        ## tradelist is some of our trades, in the same order, so it's sorted if we are
+        tradelist._date_sorted=self._date_sorted
+        return tradelist
+
     def separatecode(self):
         """
         Returns a trade_dict, with codes seperated out
         """
-        codes=[x.Code for x in self]
-        all_codes=list(set(codes))
-        results=TradeDictByCode([(Code, TradeList([trade for trade in self if trade.Code==Code])) 
-                                 for Code in all_codes])
+        results=TradeDictByCode([(SYMBOLS.name(codeid), self._same_order(TradeList(trades)))
+                                 for (codeid, trades) in group_trades(self, "CodeID")])
         
         return results
     
@@ -43,20 +136,18 @@ class TradeList(list):
         Returns a trade_dict, with FX seperated out
         
         """
-        currency=[x.Currency for x in self]
-        all_ccy=list(set(currency))
-        results=TradeDictByFX([(Currency, TradeList([trade for trade in self if trade.Currency==Currency])) 
-                               for Currency in all_ccy])
+        results=TradeDictByFX([(SYMBOLS.name(ccyid), self._same_order(TradeList(trades)))
+                               for (ccyid, trades) in group_trades(self, "CurrencyID")])
     
         return results
     
     def check_same_currency(self):
         ## Returns True if all elements are same currency
-        return check_identical_attribute(self, "Currency")
+        return check_identical_attribute(self, "CurrencyID")
     
     def check_same_code(self):
         ## Returns True if all elements have same Code
-        return check_identical_attribute(self, "Code")
+        return check_identical_attribute(self, "CodeID")
     
     def check_same_sign(self):
         signs=[np.sign(trade.SignQuantity) for trade in self]
@@ -66,13 +157,20 @@ class TradeList(list):
         """
         Sorts into TS order
         """
-        return TradeList(sorted(self, key=lambda x: x.Date))
+        if self.is_date_sorted():
+            return self._same_order(TradeList(self))
+
+        sortedlist=TradeList(sorted(self, key=lambda x: x.Date))
+        sortedlist._date_sorted=True
+
+        return sortedlist
 
     def add_signed_quantities(self):
         """
         Add an extra column, signed quantities
         """
-        return TradeList([trade.add_signed_quantity() for trade in self if "SignQuantity" not in trade.argsused])
+        signquantitybit=FIELD_BITS["SignQuantity"]
+        return TradeList([trade.add_signed_quantity() for trade in self if not trade._fieldsset & signquantitybit])
     
     def add_values(self,  raiseerror=True):
         """
@@ -108,9 +206,69 @@ class TradeList(list):
         
         return abs(values/quantity)
     
-    def as_dataframe(self, indexby="Date"):
-        
-        return list_of_dict_class_to_pandas_df(self, indexby)
+    def as_dataframe(self, indexby="Date", columns=None):
+        """
+        Returns a pandas data frame, with a column for each trade field (nan or None if a trade doesn't have it)
+
+        columns is a list of the fields we want; default is DATAFRAME_FIELDS, or use TRADE_FIELDS for all of them.
+          indexby is the field to use as the index, or None
+        """
+        if columns is None:
+            columns=DATAFRAME_FIELDS
+
+        data=dict([(fieldname, self._field_column(fieldname)) for fieldname in columns])
+
+        if indexby is None:
+            return pd.DataFrame(data)
+
+        ## Only convert the index values once, even if they are also a column
+        index=pd.Index(data[indexby] if indexby in data else self._field_column(indexby))
+        if indexby in data:
+            data[indexby]=index
+
+        return pd.DataFrame(data, index=index)
+
+    def _field_column(self, fieldname):
+        """
+        Returns the value of fieldname for each trade: a numpy array for numbers, a pandas Categorical for symbols,
+          dates as a pandas DatetimeIndex, otherwise a list. Trades which don't have fieldname give nan, or None
+        """
+        if fieldname in SYMBOL_FIELDS:
+            symbolids=self._field_values(SLOT_NAMES[fieldname], fieldname, -1, np.int64)
+
+            ## Each name is only looked up once, however many trades have it. codebyid maps id+1 to the code of its
+            ## name in the categories, so -1 (no name) gives the missing code -1
+            countbyid=np.bincount(symbolids+1, minlength=1)
+            usedids=np.flatnonzero(countbyid[1:])
+            codebyid=np.full(len(countbyid), -1, dtype=np.int64)
+            codebyid[usedids+1]=np.arange(len(usedids))
+
+            return pd.Categorical.from_codes(codebyid[symbolids+1], categories=SYMBOLS.names_of(usedids))
+
+        if fieldname=="Date":
+            return pd.DatetimeIndex(self._field_values("Date", "Date", None), dtype="datetime64[us]")
+
+        if FIELD_TYPES[fieldname] is float:
+            return self._field_values(fieldname, fieldname, np.nan, np.float64)
+
+        return self._field_values(fieldname, fieldname, None)
+
+    def _field_values(self, slotname, fieldname, missing, dtype=None):
+        """
+        Returns slotname from each trade, or missing if it hasn't got fieldname; a numpy array of dtype, or a list
+        """
+        ## Usually every trade has the field, so try going straight to the slot first; only if that fails do we
+        ## check each trade for the field
+        try:
+            if dtype is None:
+                return list(map(attrgetter(slotname), self))
+            return np.fromiter(map(attrgetter(slotname), self), dtype=dtype, count=len(self))
+        except AttributeError:
+            fieldbit=FIELD_BITS[fieldname]
+            values=[getattr(trade, slotname) if trade._fieldsset & fieldbit else missing for trade in self]
+            if dtype is None:
+                return values
+            return np.array(values, dtype=dtype)
     
     def add_fxdict_rates(self, fx_dict):
         """
@@ -128,20 +286,24 @@ class TradeList(list):
         if not self.check_same_currency():
             raise Exception("You can't apply FX rate as different currencies in TradeList")
         
-        dataframe=self.as_dataframe().sort_index()
+        dataframe=self.as_dataframe(columns=[]).sort_index()
         fxmat=uniquets(fxmat)
         fxmat=fxmat.reindex(dataframe.index, method="ffill")
-        [self[idx].modify(FXRate=float(fxmat.iloc[idx])) for idx in range(len(self))]
+        [self[idx].modify_trusted(FXRate=float(fxmat.iloc[idx])) for idx in range(len(self))]
         
         
     def all_currencies(self):
         """
         Unique list of currencies used
         """
-        return list(set(self.as_dataframe().Currency))
+        return list(set(self.as_dataframe(indexby=None, columns=["Currency"]).Currency.tolist()))
     
     def date_sort(self):
+        if self._date_sorted:
+            return
+
         self.sort(key=lambda x: x.Date)
+        self._date_sorted=True
     
     def _cumulative_trades(self):
 
@@ -158,7 +320,7 @@ class TradeList(list):
     
     def add_tradeids(self):
         
-        existing_ids_exist=["TradeID" in trade.argsused for trade in self]
+        existing_ids_exist=[trade.has_field("TradeID") for trade in self]
         
         if all(existing_ids_exist):
             existing_ids=[trade.TradeID for trade in self]
@@ -169,30 +331,11 @@ class TradeList(list):
                 print("All trades have ID's but duplicates! *** renumbering")
         
         self.timestampsort()
-        [self[idx].modify(TradeID=str(idx)) for idx in range(len(self))]
+        [self[idx].modify_trusted(TradeID=str(idx)) for idx in range(len(self))]
         
         
         
     
-    def _add_cumulative_data(self):
-        """
-        Add the  'tradetype', 'pseudotrade' labels to each trade
-        
-        """
-        
-        ## Cumulative trade is effectively position        
-        position=self._cumulative_trades()
-        
-        ## Trade type is determined by change from previous trade to this one
-        tradetypes=["Open"]+[_return_trade_type(position[idx], position[idx-1]) 
-                             for idx in range(len(position))[1:]]
-
-        ## Add data to trades        
-        [self[idx]._init_allocation(tradetype=tradetypes[idx]) for idx in range(len(self))]
-
-        
-        return self
-    
     def list_of_overclosed_trades(self):
 
         trade_types=[trade.tradetype for trade in self]
@@ -276,7 +419,7 @@ class TradeList(list):
         old_trade_count=copy(len(self))
         
         if not all([trade._has_allocation_data() for trade in self]):
-            raise Exception("You can't add spawn pseudo trades without _add_cumulative_data first")
+            raise Exception("You can't add spawn pseudo trades without add_cumulative_data first")
         
         removedtrades=TradeList()
 
@@ -345,7 +488,7 @@ class TradeList(list):
         old_trade_count=copy(len(self))
         
         if not all([trade._has_allocation_data() for trade in self]):
-            raise Exception("You can't add spawn pseudo trades without _add_cumulative_data first")
+            raise Exception("You can't add spawn pseudo trades without add_cumulative_data first")
         
         tradetopop=self[tradeidx]
         
@@ -387,7 +530,7 @@ class TradeList(list):
         old_trade_count=copy(len(self))
         
         if not all([trade._has_allocation_data() for trade in self]):
-            raise Exception("You can't add spawn pseudo trades without _add_cumulative_data first")
+            raise Exception("You can't add spawn pseudo trades without add_cumulative_data first")
 
         original_trades_to_trim=TradeList([self[idx] for idx in tradeidxlist])
         
@@ -407,12 +550,7 @@ class TradeList(list):
         tradetuplelist=TradeList([tradetopop.spawn_child_trade(pro_rata=pro_rata) for tradetopop in original_trades_to_trim])
 
         ## remove original trades
-        for trade in original_trades_to_trim:
-            ## find matching trade (can't use original indices since will change with size of list)
-            trade_idx=[idx for idx in range(len(self)) if self[idx]==trade]
-            assert len(trade_idx)==1
-            
-            self.pop(trade_idx[0])
+        self._remove_trades(original_trades_to_trim)
 
                     
         popped_trades=TradeList([tradetuple[1] for tradetuple in tradetuplelist])
@@ -440,7 +578,7 @@ class TradeList(list):
         
         ## Print trade, and parent
         for trade in self:
-            if "parent" in trade.argsused:
+            if trade.has_field("parent"):
                 parentstring=" (Allocated from: "+trade.parent.brief()+")"
             else:
                 parentstring=""
@@ -464,21 +602,123 @@ class TradeList(list):
         
         return sum(totalsinlist)
 
-def _sign_change(x,y):
-    if x>0 and y<0:
-        return True
-    elif x<0 and y>0:
+def group_trades(trades, attrname):
+    """
+    Returns a list of (value, list of trades) for each different value of attrname, in one pass
+
+    Values are in the order they first appear, and trades stay in the same order
+    """
+    groups=dict()
+    for trade in trades:
+        key=getattr(trade, attrname)
+        group=groups.get(key, None)
+        if group is None:
+            group=[]
+            groups[key]=group
+        group.append(trade)
+
+    return list(groups.items())
+
+def _trade_date(trade):
+    return trade.Date
+
+class SortedTradeList(TradeList):
+    """
+    A TradeList which is always in date order
+
+    Trades added go in after any others with the same date (as if we'd added them at the end and sorted), and
+    removing trades doesn't change the order. So we never need to sort, and can find dates with a binary search.
+    """
+
+    _date_sorted=True
+
+    def __init__(self, trades=()):
+        TradeList.__init__(self, trades)
+        list.sort(self, key=_trade_date)
+
+    def append(self, trade):
+        ## Same as bisect.insort_right, which would call our insert
+        list.insert(self, bisect.bisect_right(self, trade.Date, key=_trade_date), trade)
+
+    def extend(self, trades):
+        list.extend(self, trades)
+        list.sort(self, key=_trade_date)
+
+    def insert(self, idx, trade):
+        ## Trades can only go in one place
+        self.append(trade)
+
+    def __setitem__(self, idx, trade):
+        if isinstance(idx, slice):
+            list.__setitem__(self, idx, trade)
+            list.sort(self, key=_trade_date)
+        else:
+            list.pop(self, idx)
+            self.append(trade)
+
+    def __iadd__(self, trades):
+        self.extend(trades)
+        return self
+
+    def reverse(self):
+        raise Exception("Can't reverse a SortedTradeList")
+
+    def sort(self, *args, **kwargs):
+        raise Exception("A SortedTradeList is always in date order")
+
+    def is_date_sorted(self):
         return True
-    return False
 
-def _return_trade_type(x, lastx):
-    if _sign_change(x, lastx):
-        return "OverClose"
-    if abs(x)<abs(lastx):
-        return "Close"
-    return "Open"
-    
-        
+    def date_sort(self):
+        return
+
+    def _idx_of_date(self, tradedatetime, after_equal=False):
+        ## Index of the first trade on or after tradedatetime (or after, if after_equal is True)
+        if after_equal:
+            return bisect.bisect_right(self, tradedatetime, key=_trade_date)
+
+        return bisect.bisect_left(self, tradedatetime, key=_trade_date)
+
+    def idx_of_trades_before_datetime(self, tradetomatch):
+        return list(range(self._idx_of_date(tradetomatch.Date, after_equal=True)))
+
+    def idx_of_last_trade_same_day(self, tradetomatch):
+        ## Return indices of trades with same date, executed prior to this trade, with opposite sign
+
+        tradedatetime=tradetomatch.Date
+        startofday=datetime.datetime.combine(tradedatetime.date(), datetime.time())
+
+        ## done on same day, but not in future
+        firstidx=self._idx_of_date(startofday)
+        for idx in range(self._idx_of_date(tradedatetime)-1, firstidx-1, -1):
+            if not signs_match(self[idx].SignQuantity, tradetomatch.SignQuantity):
+                return idx
+
+        return None
+
+    def idx_of_first_trade_next_30days(self, tradetomatch):
+        ## Return index of first trade done after this trade, with opposite sign, and within 30 days
+
+        tradedatetime=tradetomatch.Date
+        endof30days=datetime.datetime.combine(tradedatetime.date()+datetime.timedelta(31), datetime.time())
+
+        ## trades are in next 30 days or today, but not in the past
+        for idx in range(self._idx_of_date(tradedatetime, after_equal=True), self._idx_of_date(endof30days)):
+            if not signs_match(self[idx].SignQuantity, tradetomatch.SignQuantity):
+                return idx
+
+        return None
+
+    def _pop_earliest_closing_trade(self):
+        """
+        Pops the earliest closing trade out of the list
+        """
+        for idx in range(len(self)):
+            if self[idx].tradetype=="Close":
+                return self.pop(idx)
+
+        return None
+
 class TradeDictByCode(dict):
     """
     A dict, each element of which is a trade_list
@@ -498,8 +738,36 @@ class TradeDictByCode(dict):
         """
         Add the 'tradetype', 'pseudotrade', 'sharedtrade' labels to each trade, in each
         element of the code dict. 
+
+        Done for all codes at once, in a TradeFrame (see TradeFrame.trade_types). Trades must already have
+          the preprocessing fields, including SignQuantity
         """
-        [x._add_cumulative_data() for x in self.values()]
+        tradelists=[tradelist for tradelist in self.values() if len(tradelist)>0]
+        trades=list(itertools.chain(*tradelists))
+        if len(trades)==0:
+            return self
+
+        ## Codes we already know are in date order don't need sorting, or dates
+        unsorted=[tradelist for tradelist in tradelists if not tradelist._date_sorted]
+        fields=["Code", "SignQuantity"]+(["Date"] if len(unsorted)>0 else [])
+        tradeframe=TradeFrame.from_tradelist(trades, fields=fields)
+
+        if not tradeframe.check_same_code_in_groups([len(tradelist) for tradelist in tradelists]):
+            raise Exception("You can't get cumulative trade data as not same code")
+
+        if len(unsorted)>0:
+            tradeframe=tradeframe.code_and_date_sort()
+
+        sortedtrades=tradeframe.trades_by_row(trades)
+        init_allocations(sortedtrades, tradeframe.trade_types())
+
+        ## Leave each code in date order, as the frame has them: one block of rows per code, in order of code id
+        codes=tradeframe.columns['Code']
+        starts=np.searchsorted(codes, np.array([tradelist[0].CodeID for tradelist in unsorted], dtype=codes.dtype))
+        for (tradelist, start) in zip(unsorted, starts.tolist()):
+            list.__setitem__(tradelist, slice(None), sortedtrades[start:start+len(tradelist)])
+            tradelist._date_sorted=True
+
         return self
     
     def generate_pseduo_trades(self):
@@ -533,15 +801,80 @@ class TradeDictByFX(dict):
 
 
 
+def _duplicate_key(trade):
+    ## Trades with the same key are the same execution
+    return (trade.CodeID, trade.Date, trade.SignQuantity, trade.Price, trade.CurrencyID, trade.Commission)
+
+def remove_duplicate_trades(tradelists, drop=True):
+    """
+    Returns a list of TradeLists, one per source, without trades we've already seen in an earlier source
+
+    Statements often overlap, eg a year to date file and a monthly file. Identical trades in the same source are
+    genuine (eg two fills in the same second) so we keep them: if a trade is n times in one source and m times
+    in earlier ones, we keep max(n, m) of them.
+
+    If drop is False we only report the duplicates.
+    """
+
+    ## How many of each trade we've kept so far, from earlier sources
+    kept_counts=dict()
+    results=[]
+    duplicate_count=0
+
+    for tradelist in tradelists:
+        seen_counts=dict()
+        uniquetrades=[]
+
+        for trade in tradelist:
+            key=_duplicate_key(trade)
+            seen_counts[key]=seen_counts.get(key, 0)+1
+
+            if seen_counts[key]>kept_counts.get(key, 0):
+                uniquetrades.append(trade)
+            else:
+                duplicate_count=duplicate_count+1
+
+        for key in seen_counts:
+            kept_counts[key]=max(kept_counts.get(key, 0), seen_counts[key])
+
+        if drop and len(uniquetrades)<len(tradelist):
+            if isinstance(tradelist, TradeList):
+                tradelist=tradelist._same_order(TradeList(uniquetrades))
+            else:
+                tradelist=TradeList(uniquetrades)
+
+        results.append(tradelist)
+
+    if duplicate_count>0:
+        if drop:
+            print("Removed %d duplicate trades which were in more than one file" % duplicate_count)
+        else:
+            print("*** %d duplicate trades which are in more than one file - not removed" % duplicate_count)
+
+    return results
+
+def merge_tradelists(tradelists):
+    """
+    Returns a single TradeList in date order, from a list of TradeLists
+
+    Each list is sorted once (if it isn't already), then they are merged. Trades with the same date stay in
+    the order they were in, with earlier lists first; the same as joining the lists and sorting them.
+    """
+
+    sortedlists=[tradelist.timestampsort() if isinstance(tradelist, TradeList)
+                 else TradeList(tradelist).timestampsort() for tradelist in tradelists]
+
+    results=TradeList(heapq.merge(*sortedlists, key=lambda x: x.Date))
+    results._date_sorted=True
+
+    return results
+
 def from_tradedict_to_list(tradedict):
     """
     Returns the dict joined together into one giant list
     """
     
-    all_keys=tradedict.keys()
-    results=[[x for x in tradedict[key]] for key in all_keys]
-    results=sum(results, [])
-    results=TradeList(results)
+    results=TradeList(itertools.chain.from_iterable(tradedict.values()))
     
     return results
 
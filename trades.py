@@ -14,40 +14,170 @@
 import datetime
 from copy import copy
 
-from utils import type_and_sense_check_arguments, signs_match, repr_class,next_letter_code, pretty
+from utils import type_and_sense_check_arguments, signs_match, repr_class,next_letter_code, pretty, \
+    letter_code_number
+from symbols import SYMBOLS
+from lineage import LINEAGE, LOTS
 
 THRESHOLD=0.0001    
 
+## The fields a trade can have
+REQUIRED_COLUMNS=['Code', 'Commission', 'Price', 'Quantity', 'Tax', 'Date',  'Currency']
+OPTIONAL_COLUMNS_MISC=['AssetClass', 'parent', 'nextchild','original']
+OPTIONAL_COLUMNS_VALUES=[ 'BS']
+OPTIONAL_COLUMNS_PREPROCESS=['FXRate', 'TradeID', 'Value', 'SignQuantity']
+OPTIONAL_COLUMNS_ALLOCATION=['tradetype', 'pseudotrade','sharedtrade']
+
+TRADE_FIELDS=REQUIRED_COLUMNS+OPTIONAL_COLUMNS_MISC+OPTIONAL_COLUMNS_VALUES+OPTIONAL_COLUMNS_PREPROCESS+ \
+    OPTIONAL_COLUMNS_ALLOCATION
+
+## Each field has a bit in Trade._fieldsset, which is set if the trade has that field
+FIELD_BITS=dict([(fieldname, 1 << fieldidx) for (fieldidx, fieldname) in enumerate(TRADE_FIELDS)])
+
+def _fields_mask(fieldnames):
+    mask=0
+    for fieldname in fieldnames:
+        mask=mask | FIELD_BITS[fieldname]
+    return mask
+
+PREPROCESS_MASK=_fields_mask(OPTIONAL_COLUMNS_PREPROCESS)
+ALLOCATION_MASK=_fields_mask(OPTIONAL_COLUMNS_ALLOCATION+['SignQuantity'])
+
+## These strings are kept as ids in symbols.SYMBOLS, in a slot with ID on the end of the name, eg CodeID
+SYMBOL_FIELDS=['Code', 'Currency', 'AssetClass']
+
+## Name of the slot each field is kept in. TradeID is kept as an id in lineage.LINEAGE, and parent and original
+## as handles in lineage.LOTS
+SLOT_NAMES=dict([(fieldname, fieldname+"ID" if fieldname in SYMBOL_FIELDS else fieldname)
+                 for fieldname in TRADE_FIELDS])
+SLOT_NAMES['TradeID']='lineageid'
+SLOT_NAMES['parent']='parentlot'
+SLOT_NAMES['original']='originallot'
+
+def _symbol_field(fieldname):
+    """
+    Returns a property which keeps the string fieldname as an id, in slot fieldnameID
+    """
+    slotname=SLOT_NAMES[fieldname]
+
+    def _get_symbol(trade):
+        return SYMBOLS.name(getattr(trade, slotname))
+
+    def _set_symbol(trade, name):
+        setattr(trade, slotname, SYMBOLS.intern(name))
+
+    return property(_get_symbol, _set_symbol)
+
+def _lot_field(fieldname):
+    """
+    Returns a property which keeps the trade fieldname as a handle in LOTS
+    """
+    slotname=SLOT_NAMES[fieldname]
+
+    def _get_lot(trade):
+        return LOTS.trade(getattr(trade, slotname))
+
+    def _set_lot(trade, lottrade):
+        setattr(trade, slotname, LOTS.add(lottrade))
+
+    return property(_get_lot, _set_lot)
+
+def _get_tradeid(trade):
+    return LINEAGE.tradeid(trade.lineageid)
+
+def _set_tradeid(trade, tradeid):
+    ## Setting an ID as a string makes it an original trade
+    trade.lineageid=LINEAGE.root(tradeid)
+
 class Trade(object):
+    """
+    A single trade
+
+    Trades have a fixed set of slots, one per field, so they are small and quick to create. The fields which
+    have been set are kept as bits in _fieldsset; argsused gives their names
+
+    Code, Currency and AssetClass are kept as integer ids (CodeID etc), which are quicker to compare; see
+    symbols.py. TradeID is kept as a lineage id, which also says which trade it was split from; and parent
+    and original as handles to trades in a central store; see lineage.py. You still get and set them as strings
+    and trades.
+    """
+
+    __slots__=tuple([SLOT_NAMES[fieldname] for fieldname in TRADE_FIELDS])+('_fieldsset',)
+
+    Code=_symbol_field('Code')
+    Currency=_symbol_field('Currency')
+    AssetClass=_symbol_field('AssetClass')
+    TradeID=property(_get_tradeid, _set_tradeid)
+    parent=_lot_field('parent')
+    original=_lot_field('original')
 
     def _possible_args(self):
-        return self._required_columns()+self._optional_columns()
+        return TRADE_FIELDS
     
     def _required_columns(self):
-        return ['Code', 'Commission', 'Price', 'Quantity', 'Tax', 'Date',  'Currency']
+        return REQUIRED_COLUMNS
 
     def _optional_columns(self):
         return self._optional_columns_misc()+self._optional_columns_values()+self._optional_columns_preprocess()+ \
             self._optional_columns_allocation()
         
     def _optional_columns_misc(self):
-        return ['AssetClass', 'parent', 'nextchild','original']
+        return OPTIONAL_COLUMNS_MISC
         
     def _optional_columns_values(self):
-        return [ 'BS']
+        return OPTIONAL_COLUMNS_VALUES
 
     def _optional_columns_preprocess(self):
-        return ['FXRate', 'TradeID', 'Value', 'SignQuantity']
+        return OPTIONAL_COLUMNS_PREPROCESS
         
     def _optional_columns_allocation(self):
-        return ['tradetype', 'pseudotrade','sharedtrade']
+        return OPTIONAL_COLUMNS_ALLOCATION
+
+    def has_field(self, fieldname):
+        """
+        Returns True if fieldname has been set on this trade
+        """
+        return (self._fieldsset & FIELD_BITS.get(fieldname, 0))!=0
+
+    @property
+    def argsused(self):
+        """
+        Names of the fields which have been set on this trade
+        """
+        fieldsset=self._fieldsset
+        return [fieldname for fieldname in TRADE_FIELDS if fieldsset & FIELD_BITS[fieldname]]
+
+    def __copy__(self):
+        newtrade=self.__class__.__new__(self.__class__)
+        fieldsset=self._fieldsset
+
+        for fieldname in TRADE_FIELDS:
+            if fieldsset & FIELD_BITS[fieldname]:
+                slotname=SLOT_NAMES[fieldname]
+                setattr(newtrade, slotname, getattr(self, slotname))
+
+        newtrade._fieldsset=fieldsset
+
+        return newtrade
+
+    def __getstate__(self):
+        ## Pickled trades can go to other processes, which have different symbol ids, so we use the strings
+        return dict([(fieldname, getattr(self, fieldname)) for fieldname in self.argsused])
+
+    def __setstate__(self, state):
+        self._fieldsset=0
+        self.modify_trusted(**state)
+
+    def _set_handle(self, fieldname, handle):
+        ## Set TradeID to a lineage id, or parent or original to a handle, without going through strings or trades
+        setattr(self, SLOT_NAMES[fieldname], handle)
+        self._fieldsset=self._fieldsset | FIELD_BITS[fieldname]
 
     def _has_preprocess_data(self):
-        return all([x in self.argsused for x in self._optional_columns_preprocess()]) 
+        return (self._fieldsset & PREPROCESS_MASK)==PREPROCESS_MASK
     
     def _has_allocation_data(self):
-        return all([x in self.argsused for x in self._optional_columns_allocation()]) and \
-            "SignQuantity" in self.argsused
+        return (self._fieldsset & ALLOCATION_MASK)==ALLOCATION_MASK
     
     def _ready_for_split(self):
         """
@@ -57,13 +187,8 @@ class Trade(object):
         
     
     def _type_check(self):
-        arg_types=dict(Code=str, Commission=float, Price=float, Quantity=float, Tax=float, Date=datetime.datetime, 
-                       BS=str, Currency=str,  Value=float, 
-                       SignQuantity=float, FXRate=float, AssetClass=str,
-                       tradetype=str, pseudotrade=bool, sharedtrade=bool, TradeID=str, parent=Trade, nextchild=str,
-                       original=Trade)
-
-        return arg_types
+        ## See FIELD_TYPES below; built once, as it refers to this class
+        return FIELD_TYPES
 
     def _check_inputs(self):
         if self.Commission<0.0:
@@ -72,18 +197,18 @@ class Trade(object):
             raise Exception("can't have negative tax")
         if self.Quantity<0:
             raise Exception("Quantity can't be negative (you're confusing with SignQuantity")
-        if "SignQuantity" in self.argsused:
-            if "Quantity" in self.argsused and "BS" in self.argsused:
+        if self.has_field("SignQuantity"):
+            if self.has_field("Quantity") and self.has_field("BS"):
                 checksignquant = self._signed_quantity()
                 
                 if checksignquant!=self.SignQuantity:
                     raise Exception("Signed quantity of %d not consistent with quantity of %d and BS of %s" % 
                                     (self.SignQuantity, self.Quantity, self.BS))
 
-        if "typestring" in self.argsused:
+        if self.has_field("typestring"):
             assert self.typestring in ["Open", "Close", "OverClose"]
 
-        if "Value" in self.argsused:
+        if self.has_field("Value"):
             if not self.Value==0.0 and self.SignQuantity==0.0:
                 assert not signs_match(self.Value, self.SignQuantity) 
         
@@ -97,28 +222,58 @@ class Trade(object):
 
         type_and_sense_check_arguments(self, kwargs)
 
-        argsused=[]
+        fieldsset=0
         for key in kwargs:
-            argsused.append(key)
+            fieldsset=fieldsset | FIELD_BITS[key]
             setattr(self, key, kwargs[key])
 
-        setattr(self, 'argsused', argsused)
+        self._fieldsset=fieldsset
         self._check_inputs()
     
     def modify(self, **kwargs):
 
         modorderfill=type_and_sense_check_arguments(self, kwargs, checkrequired=False)
-        argsused=self.argsused
+        fieldsset=self._fieldsset
 
         for key in modorderfill:
             setattr(self, key, modorderfill[key])
-            argsused.append(key)
+            fieldsset=fieldsset | FIELD_BITS[key]
             
-        argsused=list(set(argsused))    
-        setattr(self, 'argsused', argsused)
+        self._fieldsset=fieldsset
         
         self._check_inputs()
 
+    @classmethod
+    def trusted(cls, **kwargs):
+        """
+        Returns a trade, without checking the arguments or the trade
+
+        Only for values which we know are fine: built from other trades, or already checked all at once
+          (see tradetable.validate_trade_table)
+        """
+        trade=cls.__new__(cls)
+
+        fieldsset=0
+        for key in kwargs:
+            fieldsset=fieldsset | FIELD_BITS[key]
+            setattr(trade, key, kwargs[key])
+
+        trade._fieldsset=fieldsset
+
+        return trade
+
+    def modify_trusted(self, **kwargs):
+        """
+        Like modify, but without any checks. See trusted
+        """
+        fieldsset=self._fieldsset
+
+        for key in kwargs:
+            setattr(self, key, kwargs[key])
+            fieldsset=fieldsset | FIELD_BITS[key]
+
+        self._fieldsset=fieldsset
+
     def __repr__(self):
         
         return "ID %s Code %s Date %s Quantity %s Price %s Value per block %s" %  \
@@ -133,10 +288,10 @@ class Trade(object):
         print(repr_class(self))
 
     def add_value(self, raiseerror=True):
-        if "Value" in self.argsused and raiseerror:
+        if self.has_field("Value") and raiseerror:
             raise Exception("Can't add_value on trade as Value field already set")
         
-        if not "SignQuantity" in self.argsused:
+        if not self.has_field("SignQuantity"):
             self.add_signed_quantity()
         
         ## Cash flow method. Negative means buy ...
@@ -146,10 +301,10 @@ class Trade(object):
         return self
 
     def bslabel(self):
-        if "BS" in self.argsused:
+        if self.has_field("BS"):
             return self.BS
         
-        if "SignQuantity" in self.argsused:
+        if self.has_field("SignQuantity"):
             if self.SignQuantity>0:
                 return "BUY"
             elif self.SignQuantity<0:
@@ -159,7 +314,7 @@ class Trade(object):
 
     
     def _signed_quantity(self):
-        if "BS" not in self.argsused:
+        if not self.has_field("BS"):
             raise Exception("can't add signed quantity without BUY or SELL") 
         
         if self.BS=="BUY":
@@ -174,7 +329,7 @@ class Trade(object):
         return sign_quantity
 
     def add_signed_quantity(self):
-        if "SignQuantity" in self.argsused:
+        if self.has_field("SignQuantity"):
             raise Exception("Already have signed quantity")
         
         sign_quantity=self._signed_quantity()
@@ -187,7 +342,7 @@ class Trade(object):
         
         assert self._has_preprocess_data()
         
-        self.modify(tradetype=tradetype, pseudotrade=False, sharedtrade=False)
+        self.modify_trusted(tradetype=tradetype, pseudotrade=False, sharedtrade=False)
 
         
     def _share_of_trade(self, share=None, pro_rata=None):
@@ -198,7 +353,6 @@ class Trade(object):
         
         assert not (share is None and pro_rata is None)
         
-        newtrade=copy(self)
         oldquantity=copy(self.SignQuantity)
 
         if pro_rata is None:
@@ -214,14 +368,15 @@ class Trade(object):
 
             share=oldquantity*pro_rata
 
+        ## We've checked share and pro_rata, so the new trade is fine if this one is
         if pro_rata==0.0:
-            newtrade.modify(Value=0.0, Commission=0.0, Tax=0.0, 
+            newtrade=copy(self)
+            newtrade.modify_trusted(Value=0.0, Commission=0.0, Tax=0.0, 
                             SignQuantity=0.0, Quantity=0.0,   
                             )
         else:
-            newtrade.modify(Value=self.Value*pro_rata, Commission=self.Commission*pro_rata, Tax=self.Tax*pro_rata, 
-                            SignQuantity=share, Quantity=abs(share),   
-                            )
+            ## Value, Commission and Tax are only worked out if they're needed
+            newtrade=FractionalLot.share_of(self, share, pro_rata)
         
         return newtrade
         
@@ -245,19 +400,14 @@ class Trade(object):
         neworder=self._share_of_trade(share=tradetoclose)
         changedorder=self._share_of_trade(share=residualtrade)
         
-        neworder.modify(tradetype="Close")
-        changedorder.modify(tradetype="Open")
-        
-        neworder.modify(pseudotrade=True)
-        changedorder.modify(pseudotrade=True)
+        ## IDs are the old ID with :1 and :2 on the end
+        neworder.modify_trusted(tradetype="Close", pseudotrade=True)
+        neworder._set_handle('TradeID', LINEAGE.pseudo(self.lineageid, 1))
 
-        oldtradeid=self.TradeID
-        neworder.modify(TradeID=oldtradeid+":1")
-        changedorder.modify(TradeID=oldtradeid+":2")
-        
         ## To avoid duplications we make the opening order a second after the old one
         newdate=changedorder.Date+datetime.timedelta(seconds=1)
-        changedorder.modify(Date=newdate)
+        changedorder.modify_trusted(tradetype="Open", pseudotrade=True, Date=newdate)
+        changedorder._set_handle('TradeID', LINEAGE.pseudo(self.lineageid, 2))
         
         return [changedorder, neworder]
 
@@ -295,26 +445,28 @@ class Trade(object):
         else:
             raise Exception("Tried to spawn child order without share or pro rata")
 
-        original_trade=(getattr(self, "original",None))
-        if original_trade is None:
+        originallot=(getattr(self, "originallot",None))
+        if originallot is None:
             ## We keep this so we know the original size of the allocation
-            original_trade=copy(self)
-            self.modify(original=original_trade)
+            originallot=LOTS.add(copy(self))
+            self._set_handle('original', originallot)
             
 
         child_trade=self._share_of_trade(share=share, pro_rata=pro_rata)
         parent_trade=self._share_of_trade(share=residual_share, pro_rata=residual_pro_rata)
 
         
-        parent_trade.modify(nextchild=next_letter_code(thischildid))
+        parent_trade.modify_trusted(nextchild=next_letter_code(thischildid))
 
         if firstchild and self._last_child(share=share, pro_rata=pro_rata):
             ## only child- will be same as parent
-            childid=parent_trade.TradeID
-            child_trade.modify(sharedtrade=False, TradeID=childid)
+            child_trade.modify_trusted(sharedtrade=False)
+            child_trade._set_handle('TradeID', parent_trade.lineageid)
         else:
-            childid=parent_trade.TradeID+thischildid
-            child_trade.modify(sharedtrade=True, TradeID=childid, parent=original_trade)
+            ## ID is the parent's with the child letter on the end
+            child_trade.modify_trusted(sharedtrade=True)
+            child_trade._set_handle('parent', originallot)
+            child_trade._set_handle('TradeID', LINEAGE.child(parent_trade.lineageid, letter_code_number(thischildid)))
         
         return (parent_trade, child_trade)
         
@@ -344,9 +496,168 @@ class Trade(object):
         raise Exception("no share or pro rata")
     
     def total_mine_or_parent(self):
-        parent=(getattr(self, "parent",None))
+        parentlot=(getattr(self, "parentlot",None))
         
-        if parent is None:
+        if parentlot is None:
             return self.SignQuantity
         else:
-            return parent.SignQuantity
+            return LOTS.quantity(parentlot)
+
+
+## Types of each field. Values must be exactly these types, eg not np.float64
+FIELD_TYPES=dict(Code=str, Commission=float, Price=float, Quantity=float, Tax=float, Date=datetime.datetime, 
+                 BS=str, Currency=str,  Value=float, 
+                 SignQuantity=float, FXRate=float, AssetClass=str,
+                 tradetype=str, pseudotrade=bool, sharedtrade=bool, TradeID=str, parent=Trade, nextchild=str,
+                 original=Trade)
+
+def _trade_from_state(state):
+    trade=Trade.__new__(Trade)
+    trade.__setstate__(state)
+    return trade
+
+def init_allocations(trades, tradetypes):
+    """
+    Does Trade._init_allocation for each trade, with the matching element of tradetypes, in one pass
+    """
+    allocationbits=_fields_mask(OPTIONAL_COLUMNS_ALLOCATION)
+    for (trade, tradetype) in zip(trades, tradetypes):
+        fieldsset=trade._fieldsset
+        assert (fieldsset & PREPROCESS_MASK)==PREPROCESS_MASK
+
+        trade.tradetype=tradetype
+        trade.pseudotrade=False
+        trade.sharedtrade=False
+        trade._fieldsset=fieldsset | allocationbits
+
+## Fields a FractionalLot works out from the trade it's a share of
+LAZY_FIELDS=['Value', 'Commission', 'Tax']
+
+## Slots a FractionalLot copies from the trade it's a share of; (bit, slot name)
+_COPIED_SLOTS=[(FIELD_BITS[fieldname], SLOT_NAMES[fieldname]) for fieldname in TRADE_FIELDS
+               if fieldname not in LAZY_FIELDS]
+
+def _lazy_field(fieldname):
+    """
+    Returns a property for FractionalLot, which works out fieldname from the source trade the first time it's used
+    """
+    slot=Trade.__dict__[fieldname]
+
+    def _get_lazy(lot):
+        ## Go back along the sources until we find one which has the value
+        chain=[]
+        trade=lot
+        while True:
+            if type(trade) is not FractionalLot:
+                value=getattr(trade, fieldname)
+                break
+            try:
+                value=slot.__get__(trade)
+                break
+            except AttributeError:
+                chain.append(trade)
+                trade=trade.source
+
+        ## Scale it in the same order as if each share had been worked out when it was made, so the answer is
+        ## exactly the same. We keep each answer, so we only do this once
+        for trade in reversed(chain):
+            value=value*trade.pro_rata
+            slot.__set__(trade, value)
+            trade._release_source()
+
+        return value
+
+    def _set_lazy(lot, value):
+        slot.__set__(lot, value)
+
+    return property(_get_lazy, _set_lazy)
+
+class FractionalLot(Trade):
+    """
+    A share (pro_rata) of another trade (source), as made when we split trades in matching
+
+    It's a Trade, but Value, Commission and Tax are only worked out from the source when they are used, or when
+    the lot is itself split. Copying or pickling one gives a normal Trade.
+
+    The source mustn't be changed after the share is made.
+    """
+
+    __slots__=('source', 'pro_rata')
+
+    Value=_lazy_field('Value')
+    Commission=_lazy_field('Commission')
+    Tax=_lazy_field('Tax')
+
+    @classmethod
+    def share_of(cls, trade, share, pro_rata):
+        """
+        Returns a FractionalLot of trade, with SignQuantity share, which is pro_rata of the trade's
+        """
+        ## Splitting a lot again: work out its values first, so sources never build up into a chain
+        if type(trade) is FractionalLot:
+            trade._resolve()
+
+        lot=cls.__new__(cls)
+
+        fieldsset=trade._fieldsset
+        for (fieldbit, slotname) in _COPIED_SLOTS:
+            if fieldsset & fieldbit:
+                setattr(lot, slotname, getattr(trade, slotname))
+
+        lot._fieldsset=fieldsset
+        lot.source=trade
+        lot.pro_rata=pro_rata
+        lot.SignQuantity=share
+        lot.Quantity=abs(share)
+
+        return lot
+
+    def _resolve(self):
+        """
+        Works out all the lazy fields we have now, and releases the source
+        """
+        if self.source is None:
+            return
+
+        fieldsset=self._fieldsset
+        for fieldname in LAZY_FIELDS:
+            if fieldsset & FIELD_BITS[fieldname]:
+                getattr(self, fieldname)
+
+        self.source=None
+
+    def _release_source(self):
+        ## Once we have all the values we don't need the source any more
+        if self.source is None:
+            return
+
+        for fieldname in LAZY_FIELDS:
+            try:
+                Trade.__dict__[fieldname].__get__(self)
+            except AttributeError:
+                return
+
+        self.source=None
+
+    def materialise(self):
+        """
+        Returns a normal Trade with the same fields
+        """
+        trade=Trade.__new__(Trade)
+        fieldsset=self._fieldsset
+
+        for fieldname in TRADE_FIELDS:
+            if fieldsset & FIELD_BITS[fieldname]:
+                slotname=SLOT_NAMES[fieldname]
+                setattr(trade, slotname, getattr(self, slotname))
+
+        trade._fieldsset=fieldsset
+
+        return trade
+
+    def __copy__(self):
+        return self.materialise()
+
+    def __reduce_ex__(self, protocol):
+        ## Unpickles as a normal Trade
+        return (_trade_from_state, (self.__getstate__(),))
@@ -0,0 +1,178 @@
+"""
+    Python UK trading tax calculator
+
+    Copyright (C) 2015  Robert Carver
+
+    You may copy, modify and redistribute this file as allowed in the license agreement
+         but you must retain this header
+
+    See README.txt
+
+"""
+
+
+"""
+The trade table: a pandas data frame with one row per trade, which every importer produces
+
+Each broker format only has to turn its files into a trade table, with the columns in TRADE_TABLE_COLUMNS.
+We then turn that into a TradeList in one go (see tradelist_from_table), so no importer needs to build
+trades row by row.
+
+Conventions:
+   SignQuantity is positive for buys, negative for sells
+   Value uses the cash flow method, so it's negative for buys
+   Commission and Tax are positive
+   Quantity is worked out from SignQuantity
+
+To add a broker, write a function which takes a file name (and any keyword arguments) and returns a
+  trade table, and register it with register_importer. You can then read trades with read_trades, or
+  use the importer name as a reader in ingestion.get_trades_from_sources
+"""
+
+import numpy as np
+import pandas as pd
+
+from trades import Trade
+from tradelist import TradeList
+from tradecache import cached_trades
+
+## Column names, and their types, in the order trades are built with them
+TRADE_TABLE_COLUMNS=dict(Code=str, Date="datetime64[ns]", SignQuantity=np.float64, Price=np.float64,
+                         Value=np.float64, Commission=np.float64, Tax=np.float64, Currency=str, AssetClass=str)
+
+## Other trade fields an importer can include if it has them
+OPTIONAL_TABLE_COLUMNS=dict(BS=str, FXRate=np.float64, TradeID=str)
+
+## Registered importers, by name
+IMPORTERS=dict()
+
+
+def empty_trade_table():
+    """
+    Returns a trade table with no trades
+    """
+    return pd.DataFrame(dict([(colname, pd.Series([], dtype=coltype if coltype is not str else object))
+                              for (colname, coltype) in TRADE_TABLE_COLUMNS.items()]))
+
+def _table_column_to_list(column, coltype):
+    """
+    Returns a list of python values of the right type for Trade, from a column of a trade table
+    """
+    if coltype is str:
+        return column.astype(str).tolist()
+
+    if coltype=="datetime64[ns]":
+        return list(column.dt.to_pydatetime())
+
+    return column.astype(coltype).tolist()
+
+def _bad_rows(table, problems, badrows, problem):
+    """
+    Adds problem to problems for each row in badrows, a boolean array
+    """
+    for rowidx in np.flatnonzero(badrows):
+        problems.append((rowidx, "row %d (%s): %s" % (rowidx, str(table.index[rowidx]), problem)))
+
+def validate_trade_table(table):
+    """
+    Checks a whole trade table at once. Raises an exception listing every bad row, if there are any.
+
+    These are the same checks Trade makes on each trade, so we can then build the trades without checks
+    """
+
+    missing=[colname for colname in TRADE_TABLE_COLUMNS if colname not in table.columns]
+    if len(missing)>0:
+        raise Exception("Trade table is missing columns %s" % ", ".join(missing))
+
+    all_columns=dict(TRADE_TABLE_COLUMNS)
+    all_columns.update([(colname, coltype) for (colname, coltype) in OPTIONAL_TABLE_COLUMNS.items()
+                        if colname in table.columns])
+
+    problems=[]
+    for (colname, coltype) in all_columns.items():
+        column=table[colname]
+        if coltype=="datetime64[ns]":
+            if not pd.api.types.is_datetime64_any_dtype(column):
+                raise Exception("Column %s in trade table should be dates" % colname)
+        elif coltype is not str:
+            if not pd.api.types.is_numeric_dtype(column):
+                raise Exception("Column %s in trade table should be numbers" % colname)
+
+        _bad_rows(table, problems, column.isna().values, "no %s" % colname)
+
+    signquantities=table.SignQuantity.values.astype(np.float64)
+    _bad_rows(table, problems, table.Commission.values<0.0, "can't have negative commission")
+    _bad_rows(table, problems, table.Tax.values<0.0, "can't have negative tax")
+
+    if "BS" in table.columns:
+        bs=table.BS.values
+        _bad_rows(table, problems, ~np.isin(bs, ["BUY", "SELL"]), "BS must be BUY or SELL")
+        _bad_rows(table, problems, ((bs=="BUY") & (signquantities<0.0)) | ((bs=="SELL") & (signquantities>0.0)),
+                  "SignQuantity not consistent with BS")
+
+    if len(problems)>0:
+        problems.sort()
+        raise Exception("%d problems in trade table:\n%s" % (len(problems),
+                                                             "\n".join([problem[1] for problem in problems])))
+
+def tradelist_from_table(table):
+    """
+    Returns a TradeList from a trade table, built a column at a time
+
+    Any of OPTIONAL_TABLE_COLUMNS in the table are added to the trades as well
+
+    The table is checked first (see validate_trade_table), so the trades themselves don't need to be
+    """
+
+    validate_trade_table(table)
+
+    if len(table.index)==0:
+        return TradeList()
+
+    fields=list(TRADE_TABLE_COLUMNS.keys())
+    columns=[_table_column_to_list(table[colname], coltype) for (colname, coltype) in TRADE_TABLE_COLUMNS.items()]
+
+    optional_columns=[colname for colname in OPTIONAL_TABLE_COLUMNS if colname in table.columns]
+    fields=fields+optional_columns
+    columns=columns+[_table_column_to_list(table[colname], OPTIONAL_TABLE_COLUMNS[colname])
+                     for colname in optional_columns]
+
+    fields.append("Quantity")
+    columns.append(np.abs(table.SignQuantity.values.astype(np.float64)).tolist())
+
+    return TradeList([Trade.trusted(**dict(zip(fields, values))) for values in zip(*columns)])
+
+def register_importer(name, importer):
+    """
+    Adds an importer, a function fname, **kwargs -> trade table, so it can be used by name
+    """
+    IMPORTERS[name]=importer
+
+def _importer_function(importer):
+    if callable(importer):
+        return importer
+
+    if importer not in IMPORTERS:
+        raise Exception("Importer %s unknown. Use one of %s or a function" % (str(importer),
+                                                                               ", ".join(IMPORTERS.keys())))
+
+    return IMPORTERS[importer]
+
+def read_trades(fname, importer, cache_dir=None, **kwargs):
+    """
+    Returns a TradeList from file fname, using importer (a registered name, or a function) with kwargs
+
+    If cache_dir is given, the trades are kept there and we only read the file again if it has changed;
+      see tradecache.py
+    """
+
+    importer_function=_importer_function(importer)
+
+    if cache_dir is not None:
+        key_args=dict(kwargs)
+        key_args['reader']=importer if not callable(importer) else importer.__module__+"."+importer.__name__
+        read_function=lambda: read_trades(fname, importer, **kwargs)
+
+        return cached_trades(fname, key_args, read_function, cache_dir)
+
+    return tradelist_from_table(importer_function(fname, **kwargs))
@@ -48,33 +48,88 @@ def type_and_sense_check_arguments(classobject, kwargs, checkrequired=True):
 
     return kwargs
 
-def list_of_dict_class_to_pandas_df(classobject, indexname=None):
+## A number once commas and brackets have been removed
+NUMBER_PATTERN=r"[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?|[+-]?(nan|inf|infinity)"
+
+def parse_number_column(xseries, default=None):
     """
-    Takes any classobject which is a list containing objects with some attributes; turns into pd dataframe
-    
-    Optional indexname
+    Returns a list of floats from a pandas series of numbers as brokers write them, all at once
+
+    Handles commas eg '1,234.5' and negatives in brackets eg '(1,234.5)'. Numeric series are just converted.
+
+    Missing (NaN) entries become default, or stay NaN if default is None. Blank or unparseable entries become
+    default; or if default is None we raise an exception
     """
-    
-    all_keys=[x._possible_args() for x in classobject]
-    all_keys=list(set([j for i in all_keys for j in i]))
-    
-    ans={}
-    for key in all_keys:
-        ans[key]=[]
-        for x in classobject:
-            if key in dir(x):
-                ans[key].append(getattr(x, key))
-            else:
-                ans[key].append(None)
-    
-    if indexname is None:
-        ans=pd.DataFrame(ans)
+    missing=xseries.isna().values
 
+    if pd.api.types.is_numeric_dtype(xseries):
+        values=xseries.astype(np.float64).values.copy()
     else:
-        ans=pd.DataFrame(ans, index=ans[indexname])
+        strings=xseries.astype(str).str.strip()
+        negative=(strings.str.startswith("(") & strings.str.endswith(")")).values
+        strings=strings.str.replace(r"[,()]", "", regex=True)
+
+        ## Missing entries are 'nan' as strings, which would parse as NaN and not get default
+        valid=strings.str.fullmatch(NUMBER_PATTERN, case=False).values & ~missing
+        if not (valid | missing).all() and default is None:
+            raise Exception("Can't parse '%s' as a number" % xseries[~(valid | missing)].iloc[0])
+
+        ## astype gives exactly the same answer as float() on each string would
+        values=np.full(len(strings), default if default is not None else np.nan, dtype=np.float64)
+        values[valid]=strings[valid].astype(np.float64).values
+        values[negative]=-values[negative]
+
+    if default is not None:
+        values[missing]=default
+
+    return values.tolist()
+
+## The format that last worked for a column of dates, by column name and list of possible formats
+_date_formats_used=dict()
+
+def parse_date_column(xseries, formats):
+    """
+    Returns a list of datetimes from a pandas series of date strings, which can be in any of formats
+
+    We parse the whole column with one format at a time, rather than trying each format on each date.
+    The format which worked last time we saw a column with this name goes first, so usually only one is needed.
+    """
+    cache_key=(xseries.name, tuple(formats))
+    last_format=_date_formats_used.get(cache_key, None)
+    if last_format is not None:
+        formats=[last_format]+[dateformat for dateformat in formats if dateformat!=last_format]
+
+    dates=pd.Series(pd.NaT, index=xseries.index, dtype="datetime64[ns]")
+
+    for dateformat in formats:
+        missing=dates.isna()
+        if not missing.any():
+            break
+
+        parsed=pd.to_datetime(xseries[missing], format=dateformat, errors="coerce")
+        if parsed.notna().any():
+            _date_formats_used[cache_key]=dateformat
+            dates=dates.fillna(parsed)
+
+    missing=dates.isna()
+    if missing.any():
+        raise Exception("Can't parse date %s with any of %s" % (xseries[missing].iloc[0], str(formats)))
+
+    return list(dates.dt.to_pydatetime())
+
+## How buys and sells are written
+BS_CODES=dict(B="BUY", S="SELL", BUY="BUY", SELL="SELL")
+
+def parse_bs_column(xseries):
+    """
+    Returns a list of 'BUY' and 'SELL' from a pandas series of B/S codes
+    """
+    bs=xseries.astype(str).str.strip().str.upper().map(BS_CODES)
+    if bs.isna().any():
+        raise Exception("B/S must be B or S, not %s" % xseries[bs.isna()].iloc[0])
+
+    return bs.tolist()
 
-    return ans
-                 
 def uniquets(df3):
     """
     Makes x unique
@@ -158,6 +213,14 @@ def next_letter_code(letter):
     
     return letter[:-1]+next_letter
 
+def letter_code(number):
+    ## The number'th letter code (from 0) in the sequence next_letter_code gives: a, b, ... z, za, zb, ... zz, zza ...
+    return "z"*(number // 26)+chr(ord("a")+number % 26)
+
+def letter_code_number(letter):
+    ## Inverse of letter_code
+    return 26*(len(letter)-1)+ord(letter[-1])-ord("a")
+
 def pretty(x, commas=True):
     """
     Return a string of x formatted nicely